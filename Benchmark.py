@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy
+
+import BitField
+import Cache
+import Evaluation
+import Features
+import Field
+import Pieces
+import State
+import Tetris
+import ValueIteration
+
+
+# Benchmarks of the hot paths, on the boards of a saved corpus and with fixed seeds.
+# Every benchmark is timed repeat times, each time over enough calls to last at least
+# duration seconds, and the time per call of the fastest and median repetition is kept.
+# The results are written as JSON and compared with a baseline written the same way, by
+# default the committed benchmark_baseline.json (its meta tells the machine it was run on).
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_boards.json')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+BACKENDS = {'BitField': BitField.BitField, 'Field': Field.Field}
+CACHE = 10000 # capacity of the cache of the states of the cached benchmarks
+
+# weights of the features in the benchmarks, the same for every value of a feature or a
+# function of the number of columns giving its values
+WEIGHTS = {
+    'height_differences': lambda m: [-0.05 * abs(j - (m - 2) // 2) for j in range(m - 1)],
+    'max_height': -0.5,
+    'min_height': 0.0,
+    'holes': -1.0,
+    'average_height': -0.3,
+    'bumpiness': -0.2,
+    'connected_holes': -1.0,
+    'row_transitions': -1.0,
+    'column_transitions': -1.0,
+    'wells': -1.0,
+    'rows_with_holes': -1.0,
+    'hole_depth': -0.5,
+    'landing_height': -1.0,
+    'eroded_cells': 1.0,
+}
+
+
+# returns the weights of the benchmarks for a board of m columns and the feature set (cfr.
+# Features.get), by default the one of the fields
+def weights(m, features=None):
+    features = Field.Field.FEATURES if features is None else Features.get(features)
+    w = []
+    for feature in features.features:
+        weight = WEIGHTS[feature]
+        w += weight(m) if callable(weight) else [weight] * Features.FEATURES[feature].dimension(m)
+    return w
+
+
+# returns the field of the given backend with the rows, written top to bottom with # for filled cells
+def make_field(backend, n, m, rows):
+    if backend is BitField.BitField:
+        return BitField.BitField(n, m, [sum(1 << j for j in range(m) if row[j] == '#') for row in rows])
+
+    grid = [[1 if cell == '#' else 0 for cell in row] for row in rows]
+    accessible = [min([i for i in range(n) if grid[i][j] == 1], default=n) for j in range(m)]
+    return Field.Field(n, m, grid, accessible, [[''] * m for i in range(n)])
+
+
+# returns the rows of a field, written top to bottom with # for filled cells
+def rows_of(field):
+    return [''.join('#' if cell else '.' for cell in row) for row in field.grid]
+
+
+# plays the policy from the empty board with the seed and returns the first field accepted
+# by stop, the last field of the game if there is none
+def play_until(n, m, policy, seed, stop):
+    random.seed(seed)
+    field = BitField.BitField(n, m)
+    for tile in Pieces.Pieces(seed, n_tiles=len(Tetris.Tetris.TILES)):
+        if stop(field):
+            break
+        move = policy(State.State(field, tile))
+        if move is None:
+            break
+        field = field.successor(Tetris.Tetris.TILES[tile], move)[0]
+    return field
+
+
+# generates the board corpus on a n x m board : empty, mid-game, near top-out, hole-heavy
+def make_corpus(n=20, m=10):
+    w = weights(m)
+    vf = lambda state: state.vf_move(w)
+    boards = {
+        'empty': BitField.BitField(n, m),
+        'midgame': play_until(n, m, vf, 1, lambda field: field.highest >= n // 2),
+        'topout': play_until(n, m, vf, 2, lambda field: field.highest >= n - 3),
+        'holes': play_until(n, m, lambda state: state.random_move(), 3,
+                            lambda field: field.holes >= 2 * n or field.highest >= n - 6),
+    }
+    return {'n': n, 'm': m, 'boards': {name: rows_of(field) for name, field in boards.items()}}
+
+
+def load_corpus(path=CORPUS):
+    with open(path) as f:
+        return json.load(f)
+
+
+# returns the fastest and median time per call of f in microseconds, and the number of calls
+def measure(f, repeat=5, duration=0.05):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(duration / elapsed * 1.2))
+
+    times = [elapsed / number]
+    for r in range(repeat - 1):
+        start = time.perf_counter()
+        for i in range(number):
+            f()
+        times.append((time.perf_counter() - start) / number)
+    return {'us': 1e6 * min(times), 'median_us': 1e6 * statistics.median(times), 'calls': number * repeat}
+
+
+# returns f caching the states in a new cache of capacity states at every call (cfr.
+# Cache.enable), the cache of the last call being its attribute cache
+def cached(f, capacity=CACHE):
+    def call():
+        call.cache = Cache.enable(capacity)
+        try:
+            return f()
+        finally:
+            Cache.disable()
+    call.cache = None
+    return call
+
+
+# plays games of the value-function policy with the fields of the backend, as Tetris.test_vf
+def test_vf(backend, n, m, w, games=8):
+    previous = Tetris.Tetris.FIELD
+    Tetris.Tetris.FIELD = backend
+    try:
+        return Evaluation.evaluate(n, m, ['vf'], w, games, seed=0, processes=1)
+    finally:
+        Tetris.Tetris.FIELD = previous
+
+
+# returns the benchmarks of a backend, by name : functions of no argument, called after
+# reseeding random
+# the benchmarks whose name ends with /cached are those of the same name without it with a
+# cache of the states (cfr. cached)
+def benchmarks(backend, corpus):
+    n, m = corpus['n'], corpus['m']
+    tiles = Tetris.Tetris.TILES
+    w = weights(m)
+    result = {}
+
+    for name, rows in corpus['boards'].items():
+        field = make_field(backend, n, m, rows)
+        moves = [(tile, move) for tile in tiles for move in field.positions(tile)]
+
+        result['positions/%s' % name] = lambda field=field: [field.positions(tile) for tile in tiles]
+        result['successor/%s' % name] = lambda field=field, moves=moves: \
+            [field.successor(tile, move) for tile, move in moves]
+        result['utility/%s' % name] = lambda field=field: field.utility(w)
+        result['n_inaccessibles/%s' % name] = lambda field=field: field.n_inaccessibles()
+        result['n_holes/%s' % name] = lambda field=field: field.n_holes()
+        result['State/%s' % name] = lambda field=field: [State.State(field, tile) for tile in range(len(tiles))]
+        for policy, move in (('vf_move', lambda state: state.vf_move(w)),
+                             ('lowest_move', lambda state: state.lowest_move()),
+                             ('random_move', lambda state: state.random_move()),
+                             ('hole_move', lambda state: state.hole_move())):
+            result['%s/%s' % (policy, name)] = lambda field=field, move=move: \
+                [move(State.State(field, tile)) for tile in range(len(tiles))]
+
+    game = Tetris.Tetris(10, 6)
+    game.FIELD = backend
+    zeros = [0.0] * backend(10, 6).dimension()
+    result['episode/10x6'] = lambda: (random.seed(0), game.episode(zeros, 0.01, 0.1, seed=0))
+    result['episode/10x6/cached'] = cached(result['episode/10x6'])
+    w_vf = weights(6, backend.FEATURES.name)
+    result['test_vf/10x6'] = lambda: test_vf(backend, 10, 6, w_vf)
+    result['test_vf/10x6/cached'] = cached(result['test_vf/10x6'])
+
+    table = ValueIteration.ValueTable(4, 3)
+    table.explore(verbose=False)
+    result['value_sweep/4x3'] = table.sweep
+
+    return result
+
+
+# runs the benchmarks whose name contains one of the filters (all of them without filter)
+# the cached benchmarks also give the hit rate of their cache and their speedup over the
+# benchmark without cache when it ran
+def run(backend='BitField', corpus=None, filters=None, repeat=5, duration=0.05, verbose=True):
+    corpus = load_corpus() if corpus is None else corpus
+    results = {}
+    for name, f in benchmarks(BACKENDS[backend], corpus).items():
+        if filters and not any(pattern in name for pattern in filters):
+            continue
+        random.seed(0)
+        results[name] = measure(f, repeat, duration)
+        if verbose:
+            print("%-28s %12.1f us" % (name, results[name]['us']), end='')
+        if name.endswith('/cached'):
+            results[name]['hit_rate'] = f.cache.hit_rate()
+            uncached = results.get(name[:-len('/cached')])
+            if uncached is not None:
+                results[name]['speedup'] = uncached['us'] / results[name]['us']
+            if verbose:
+                print("   hit rate %5.1f%%" % (100 * results[name]['hit_rate']), end='')
+                if uncached is not None:
+                    print("   speedup %5.2fx" % results[name]['speedup'], end='')
+        if verbose:
+            print()
+
+    return {
+        'meta': {'backend': backend, 'python': platform.python_version(), 'numpy': numpy.__version__,
+                 'machine': platform.machine(), 'processor': platform.processor(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat, 'duration': duration},
+        'results': results,
+    }
+
+
+# returns the speedup of every benchmark over the baseline (baseline time / current time)
+def compare(report, baseline):
+    return {name: baseline['results'][name]['us'] / result['us']
+            for name, result in report['results'].items() if name in baseline['results']}
+
+
+def print_comparison(report, baseline, speedups):
+    print("%-28s %12s %12s %9s" % ('benchmark', baseline['meta']['backend'], report['meta']['backend'], 'speedup'))
+    for name, speedup in speedups.items():
+        print("%-28s %9.1f us %9.1f us %8.2fx" %
+              (name, baseline['results'][name]['us'], report['results'][name]['us'], speedup))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='BitField')
+    parser.add_argument('--filter', action='append', help='only run the benchmarks containing this text')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=0.05, help='minimum seconds per repetition')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE,
+                        help='compare with the results of this JSON file, by default %s' % os.path.basename(BASELINE))
+    parser.add_argument('--make-corpus', action='store_true', help='regenerate %s' % os.path.basename(CORPUS))
+    args = parser.parse_args()
+
+    if args.make_corpus:
+        with open(CORPUS, 'w') as f:
+            json.dump(make_corpus(), f, indent=1)
+
+    report = run(args.backend, filters=args.filter, repeat=args.repeat, duration=args.duration)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['speedups'] = compare(report, baseline)
+        print_comparison(report, baseline, report['speedups'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    elif not args.baseline:
+        json.dump(report, sys.stdout, indent=1)
+        print()
@@ -0,0 +1,287 @@
+import Field
+import functools
+import itertools
+import operator
+
+
+# Field backend storing every row as one integer bitmask (bit j is the cell of column j).
+# Colors are only kept when the field is created with colored=True, as a list of rows
+# which are shared between copies and only copied when written to.
+# The number of cells, the sum and maximum of the column heights and the bumpiness are
+# updated incrementally when cells are set and rows removed.
+class BitField(Field.Field):
+
+    # maintained incrementally, these attributes replace the properties of Field
+    highest = 0
+    bumpiness = 0
+
+    def __init__(self, n, m, rows=None, accessible=None, color=None, colored=False, features=None):
+        self.n = n
+        self.m = m
+        self.full = (1 << m) - 1
+        self.rows = rows
+        self.accessible = accessible
+        self.color = color
+        self.cleared = 0 # rows cleared by the last tile
+        self.landing = 0 # height of the middle of the last tile
+        self.eroded = 0  # cells of the last tile cleared, times the rows cleared
+
+        if rows is None:
+            self.rows = [0] * self.n
+            self.accessible = [self.n] * self.m
+            if colored:
+                self.color = [[''] * self.m] * self.n
+            features = (0, 0, 0, 0)
+        elif accessible is None:
+            self.update_accessible()
+
+        if features is None:
+            self.cells = sum(row.bit_count() for row in self.rows)
+            self.update_heights()
+        else:
+            self.cells, self.height_sum, self.highest, self.bumpiness = features
+
+    def __copy__(self):
+        color = self.color
+        if color is not None:
+            color = color[:]
+        return BitField(self.n, self.m, self.rows[:], self.accessible[:], color,
+                        features=(self.cells, self.height_sum, self.highest, self.bumpiness))
+
+    # number of inaccessible cells
+    @property
+    def holes(self):
+        return self.height_sum - self.cells
+
+    # average height of the columns
+    @property
+    def average(self):
+        return self.height_sum / self.m
+
+    # minimum height of the non-empty columns
+    @functools.cached_property
+    def lowest(self):
+        return self.n - max([acc for acc in self.accessible if acc < self.n], default=0)
+
+    # returns the grid as a matrix of 0/1 cells
+    @property
+    def grid(self):
+        return [[(row >> j) & 1 for j in range(self.m)] for row in self.rows]
+
+    # returns the exact representation of the grid
+    def representation(self):
+        return self.key()
+
+    # returns the rows packed in one integer, the top row in the most significant bits
+    def key(self):
+        key = 0
+        for row in self.rows:
+            key = (key << self.m) | row
+        return key
+
+    # returns the key of the field mirrored left to right
+    def mirror_key(self):
+        key = 0
+        for row in self.rows:
+            key = (key << self.m) | int(format(row, '0%db' % self.m)[::-1], 2)
+        return key
+
+    # returns the field mirrored left to right
+    def mirror(self):
+        return BitField.from_key(self.n, self.m, self.mirror_key())
+
+    # returns the key of (field, tile) that is the same for the field and its mirror image,
+    # and whether it is the key of the mirror image
+    def canonical(self, tile):
+        import Tetris
+        key = self.key()
+        mirrored = (self.mirror_key(), Tetris.Tetris.MIRROR[tile])
+        if mirrored < (key, tile):
+            return mirrored, True
+        return (key, tile), False
+
+    # rebuilds the field from its key
+    @classmethod
+    def from_key(cls, n, m, key):
+        full = (1 << m) - 1
+        return cls(n, m, [(key >> (m * (n-1-i))) & full for i in range(n)])
+
+    # returns the maximum height of a column and the average height
+    def max_height(self):
+        return self.highest, self.average
+
+    # sets the cell (i, j) to the color
+    def set(self, i, j, color):
+        if not (self.rows[i] >> j) & 1:
+            self.rows[i] |= 1 << j
+            self.cells += 1
+        if i < self.accessible[j]:
+            self.raise_column(j, i)
+        if self.color is not None:
+            row = self.color[i][:]
+            row[j] = color
+            self.color[i] = row
+
+    # moves the top of column j up to row i and updates the height features
+    def raise_column(self, j, i):
+        accessible = self.accessible
+        for k in (j - 1, j + 1):
+            if 0 <= k < self.m:
+                self.bumpiness += abs(accessible[k] - i) - abs(accessible[k] - accessible[j])
+        self.height_sum += accessible[j] - i
+        self.highest = max(self.highest, self.n - i)
+        accessible[j] = i
+        self.__dict__.pop('lowest', None)
+
+    # tells whether a tile can be shifted to left or right
+    def can_shift(self, tile, i, j):
+        for k in range(0, tile.n):
+            if (tile.masks[k] << j) & self.rows[i + k]:
+                return False
+        return True
+
+    # returns all the positions where the tile and its rotations can be places
+    # the landing row of each column is read from the column tops and the bottom profile of the tile
+    def positions(self, cardinal_tile):
+        accessible = self.accessible
+        pos = []
+        for rot in cardinal_tile.distinct:
+            tile = cardinal_tile.rotation(rot)
+            count = self.m - tile.m + 1
+            if count <= 0:
+                continue
+            tops = [map(operator.sub, accessible[l:l+count], itertools.repeat(b + 1)) for l, b in enumerate(tile.bottoms)]
+            lands = list(map(min, itertools.repeat(self.n), *tops))
+            pos += [(i, j, rot) for j, i in enumerate(lands) if i >= 0]
+
+            # shift tiles when at bottom, the lowest shift is kept when several reach the same column
+            if min(lands) < 0:
+                shifts = {}
+                for oj in range(0, count):
+                    i = lands[oj]
+                    for step in (-1, 1):
+                        j = oj + step
+                        while i >= 0 and 0 <= j < count and lands[j] < 0 and self.can_shift(tile, i, j):
+                            if shifts.get(j, -1) < i:
+                                shifts[j] = i
+                            j += step
+                pos += [(i, j, rot) for j, i in sorted(shifts.items())]
+        return pos
+
+    # sets the tile at the given position and returns the reward and the game gain
+    def set_tile(self, tile, i, j, rot):
+        prev_holes = self.holes
+        prev_avg = self.average
+        tile = tile.rotation(rot)
+        rows = self.rows
+        for k in range(0, tile.n):
+            rows[i+k] |= tile.masks[k] << j
+        self.cells += tile.size
+        for l in range(0, tile.m):
+            if i + tile.tops[l] < self.accessible[j+l]:
+                self.raise_column(j+l, i + tile.tops[l])
+        if self.color is not None:
+            for k in range(0, tile.n):
+                row = self.color[i+k][:]
+                for l in range(0, tile.m):
+                    if tile.get(k, l) == 1:
+                        row[j+l] = tile.color
+                self.color[i+k] = row
+
+        count = rows[i:i+tile.n].count(self.full)
+        eroded = 0
+        if count > 0:
+            for k in range(0, tile.n):
+                if rows[i+k] == self.full:
+                    eroded += tile.masks[k].bit_count()
+            first = rows.index(self.full, i)
+            if self.color is not None:
+                self.color = [[''] * self.m] * count + \
+                             [self.color[k] for k in range(self.n) if rows[k] != self.full]
+            self.rows = rows = [0] * count + [row for row in rows if row != self.full]
+            self.cells -= count * self.m
+
+            # the full rows lie below every column top, only the columns topped by
+            # the first full row have to look for their new top
+            remaining = 0
+            for l in range(0, self.m):
+                if self.accessible[l] == first:
+                    remaining |= 1 << l
+                    self.accessible[l] = self.n
+                else:
+                    self.accessible[l] += count
+            for k in range(first + 1, self.n):
+                if remaining == 0:
+                    break
+                hit = rows[k] & remaining
+                while hit:
+                    low = hit & -hit
+                    self.accessible[low.bit_length() - 1] = k
+                    hit ^= low
+                remaining &= ~rows[k]
+            self.update_heights()
+
+        value = 0
+        value += 1 * (prev_holes - self.holes)
+        value += 3 * (prev_avg - self.average)
+
+        self.cleared = count
+        self.landing = self.n - i - (tile.n - 1) / 2
+        self.eroded = count * eroded
+        import Tetris
+        return value, 100 * ((count * Tetris.Tetris.ROW_GAIN) ** 2)
+
+    # removes the row k
+    def remove_row(self, k):
+        self.cells -= self.rows[k].bit_count()
+        del self.rows[k]
+        self.rows.insert(0, 0)
+        if self.color is not None:
+            del self.color[k]
+            self.color.insert(0, [''] * self.m)
+        self.update_accessible()
+        self.update_heights()
+
+    # recomputes the top cell of every column
+    def update_accessible(self):
+        self.accessible = [self.n] * self.m
+        remaining = self.full
+        for i in range(0, self.n):
+            hit = self.rows[i] & remaining
+            while hit:
+                low = hit & -hit
+                self.accessible[low.bit_length() - 1] = i
+                hit ^= low
+            remaining &= ~self.rows[i]
+            if remaining == 0:
+                break
+
+    # recomputes the sum and maximum of the column heights and the bumpiness
+    def update_heights(self):
+        accessible = self.accessible
+        self.height_sum = self.n * self.m - sum(accessible)
+        self.highest = self.n - min(accessible)
+        self.bumpiness = sum(abs(accessible[j] - accessible[j+1]) for j in range(0, self.m-1))
+        self.__dict__.pop('lowest', None)
+
+    # returns the rows as bitmasks, bit j being the cell of column j
+    def row_masks(self):
+        return self.rows
+
+    # computes the number of inaccessible cells
+    def n_inaccessibles(self):
+        return self.holes
+
+    def print(self):
+        for i in range(self.n):
+            print('|', end='')
+            for j in range(self.m):
+                if (self.rows[i] >> j) & 1:
+                    if self.color is not None and self.color[i][j] != "":
+                        print(self.color[i][j] + "  " + '\x1b[0m', end='')
+                    else:
+                        print('\x1b[6;30;40m' + "  " + '\x1b[0m', end='')
+                else:
+                    print('  ', end='')
+            print('|')
+        print()
@@ -0,0 +1,60 @@
+import collections
+
+
+# Bounded least-recently-used cache, counting its hits, misses and evictions
+class Cache:
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # returns the value of the key, None if it is not cached
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    # caches the value of the key, evicting the least recently used keys above capacity
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+    def report(self):
+        print("Cache : %d/%d entries, %d hits, %d misses, %d evictions, hit rate %.1f%%" %
+              (len(self.entries), self.capacity, self.hits, self.misses, self.evictions, 100 * self.hit_rate()))
+
+
+# caches the states (board, tile) of this process in a new cache of the given capacity
+# and returns it, the processes of a pool get their own cache when this is their initializer
+def enable(capacity=1000):
+    import State
+    State.State.CACHE = Cache(capacity)
+    return State.State.CACHE
+
+
+# stops caching the states of this process
+def disable():
+    import State
+    State.State.CACHE = None
@@ -0,0 +1,195 @@
+import argparse
+import math
+import multiprocessing
+import time
+
+import numpy
+
+import Evaluation
+import Features
+import Field
+import Simulator
+import Storage
+
+
+# rolls out games of the weight vectors (rows of W) with the simulator, the game k of every
+# vector playing the same pieces (those of the seed seed + k)
+# every check pieces after the first warmup * max_pieces, the vectors whose mean score is below
+# cutoff * threshold, scaled by the share of max_pieces played, are terminated (never without
+# max_pieces); the games stop when budget seconds are elapsed
+# returns the mean score of every vector, and the number of games, pieces, terminated vectors
+# and whether the games all ended before the budget
+def rollouts(n, m, W, games, seed, max_pieces, features, threshold=None, cutoff=0.1, warmup=0.25, budget=None,
+             check=25):
+    start = time.time()
+    W = numpy.asarray(W, dtype=float)
+    owner = numpy.repeat(numpy.arange(len(W)), games)
+    sim = Simulator.Simulator(n, m, len(owner), seed, max_pieces, features, streams=games)
+    policy = Simulator.linears(W[owner])
+    terminated = numpy.zeros(len(W), dtype=bool)
+    complete = True
+
+    step = 0
+    while sim.alive.any():
+        sim.step(policy)
+        step += 1
+        if step % check != 0:
+            continue
+        if budget is not None and time.time() - start > budget:
+            complete = False
+            break
+        if threshold is not None and threshold > 0 and max_pieces is not None and step >= warmup * max_pieces:
+            scores = sim.scores.reshape(len(W), games).mean(axis=1)
+            bad = (scores < cutoff * threshold * step / max_pieces) & sim.alive.reshape(len(W), games).any(axis=1)
+            sim.alive[bad[owner]] = False
+            terminated |= bad
+
+    scores = sim.scores.reshape(len(W), games).mean(axis=1)
+    return scores, {'games': len(owner), 'pieces': int(sim.pieces.sum()), 'terminated': int(terminated.sum()),
+                    'complete': complete}
+
+
+def rollouts_task(args):
+    return rollouts(*args)
+
+
+# Noisy cross-entropy search of the weights of the value-function approximation, cfr. Szita
+# and Lorincz, Learning Tetris Using the Noisy Cross-Entropy Method (2006).
+# Every generation samples population weight vectors from a gaussian with independent
+# components, rolls out games of all of them in lockstep with common pieces (the games of a
+# generation use the same piece sequences, which change with the generations) and fits the
+# gaussian to the elite fraction of the vectors with the best mean score. noise, decreasing
+# by decay every generation, is added to the variance so that it does not collapse too early.
+# The vectors far below the elite of the previous generation are terminated early (cfr.
+# rollouts), and with budget the games of a generation stop after budget seconds, the
+# vectors being ranked on the scores reached. With processes, the vectors are split between
+# the processes of a pool (all the processors with processes None).
+# The weights are those of the feature set (cfr. Features.get), by default the one of the fields.
+class CrossEntropy:
+
+    def __init__(self, n, m, population=100, elite=0.1, games=10, max_pieces=1000, mean=None, variance=100.0,
+                 noise=4.0, decay=0.1, cutoff=0.1, warmup=0.25, budget=None, seed=0, processes=1, features=None):
+        self.n = n
+        self.m = m
+        self.population = population
+        self.elite = max(1, int(round(elite * population)))
+        self.games = games
+        self.max_pieces = max_pieces
+        self.noise = noise
+        self.decay = decay
+        self.cutoff = cutoff
+        self.warmup = warmup
+        self.budget = budget
+        self.seed = seed
+        self.processes = multiprocessing.cpu_count() if processes is None else processes
+        self.features = Field.Field.FEATURES if features is None else Features.get(features)
+
+        dimension = self.features.dimension(m)
+        self.mean = numpy.zeros(dimension) if mean is None else numpy.array(mean, dtype=float)
+        self.variance = numpy.full(dimension, float(variance))
+        self.rng = numpy.random.default_rng(seed)
+        self.generation = 0
+        self.threshold = None # score of the last elite vector of the last generation
+        self.best = None      # best vector sampled and its score
+        self.best_score = -math.inf
+
+    # returns the weights to play with : the best vector sampled so far when best, the mean of
+    # the gaussian otherwise (or before any generation)
+    def weights(self, best=True):
+        if best and self.best is not None:
+            return self.best
+        return self.mean.tolist()
+
+    # samples the weight vectors of a generation
+    def sample(self):
+        return self.mean + self.rng.standard_normal((self.population, len(self.mean))) * numpy.sqrt(self.variance)
+
+    # returns the mean scores of the weight vectors and the statistics of their rollouts
+    def evaluate(self, W, pool=None):
+        seed = self.seed + self.generation * self.games
+        if pool is None:
+            return rollouts(self.n, self.m, W, self.games, seed, self.max_pieces, self.features, self.threshold,
+                            self.cutoff, self.warmup, self.budget)
+
+        chunks = [chunk for chunk in numpy.array_split(W, self.processes) if len(chunk) > 0]
+        tasks = [(self.n, self.m, chunk, self.games, seed, self.max_pieces, self.features, self.threshold,
+                  self.cutoff, self.warmup, self.budget) for chunk in chunks]
+        results = pool.map(rollouts_task, tasks)
+        stats = {'games': sum(r[1]['games'] for r in results), 'pieces': sum(r[1]['pieces'] for r in results),
+                 'terminated': sum(r[1]['terminated'] for r in results),
+                 'complete': all(r[1]['complete'] for r in results)}
+        return numpy.concatenate([r[0] for r in results]), stats
+
+    # runs one generation and returns its summary
+    def step(self, pool=None):
+        start = time.time()
+        W = self.sample()
+        scores, stats = self.evaluate(W, pool)
+        order = numpy.argsort(-scores, kind='stable')
+        elite = W[order[:self.elite]]
+
+        noise = max(self.noise - self.decay * self.generation, 0)
+        self.mean = elite.mean(axis=0)
+        self.variance = elite.var(axis=0) + noise
+        self.threshold = float(scores[order[self.elite - 1]])
+        if scores[order[0]] > self.best_score:
+            self.best = W[order[0]].tolist()
+            self.best_score = float(scores[order[0]])
+        self.generation += 1
+
+        elapsed = time.time() - start
+        stats.update({'generation': self.generation, 'best': float(scores[order[0]]),
+                      'elite': float(scores[order[:self.elite]].mean()), 'population': float(scores.mean()),
+                      'threshold': self.threshold, 'noise': noise, 'time': elapsed,
+                      'games_per_s': stats['games'] / max(elapsed, 1e-9),
+                      'pieces_per_s': stats['pieces'] / max(elapsed, 1e-9)})
+        return stats
+
+    # runs the generations and returns the weights (cfr. weights), the generations are printed
+    # when verbose and recorded in metrics when given (a Metrics.Metrics)
+    def run(self, generations=20, metrics=None, verbose=True, best=True):
+        pool = None
+        if self.processes != 1:
+            pool = multiprocessing.Pool(self.processes, Evaluation.initialize, Evaluation.settings())
+        try:
+            for g in range(generations):
+                stats = self.step(pool)
+                if verbose:
+                    print("Generation %d  elite score %f  best %f  (%d games, %.1f games/s, %d terminated%s)" %
+                          (stats['generation'], stats['elite'], stats['best'], stats['games'], stats['games_per_s'],
+                           stats['terminated'], '' if stats['complete'] else ', out of time'))
+                if metrics is not None:
+                    metrics.log('generation', **stats)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return self.weights(best)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Noisy cross-entropy search of the weights')
+    parser.add_argument('--size', type=int, nargs=2, default=(20, 10), metavar=('N', 'M'))
+    parser.add_argument('--features', default='default', help='feature set, cfr. Features.get')
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--population', type=int, default=100)
+    parser.add_argument('--elite', type=float, default=0.1, help='fraction of the population kept')
+    parser.add_argument('--games', type=int, default=10, help='games per weight vector')
+    parser.add_argument('--max-pieces', type=int, default=1000)
+    parser.add_argument('--budget', type=float, help='seconds of rollouts per generation')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mean', action='store_true',
+                        help='write the mean of the final gaussian rather than the best vector sampled')
+    parser.add_argument('--output', default='weights.json', help='write the weights to this file, cfr. Tetris.load_weights')
+    args = parser.parse_args()
+
+    features = Features.use(args.features)
+    search = CrossEntropy(*args.size, population=args.population, elite=args.elite, games=args.games,
+                          max_pieces=args.max_pieces, budget=args.budget, seed=args.seed, processes=args.processes,
+                          features=features)
+    w = search.run(args.generations, best=not args.mean)
+    if not args.mean:
+        print("Best vector : mean score %f over %d games" % (search.best_score, args.games))
+    Storage.save_weights(args.output, w, *args.size, features.name)
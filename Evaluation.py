@@ -0,0 +1,206 @@
+import math
+import multiprocessing
+import random
+import time
+
+import Cache
+import Features
+import Field
+import Pieces
+import Policies
+import Replay
+import State
+
+
+# plays one game with every policy in a single pass, the tiles only depend on the seed
+# (cfr. Pieces.Pieces), or are those of sequence (bytes) when it is given, and the random
+# moves are drawn from a generator of the seed set on the agent
+# the policies sharing a board share its state, so that its moves and successors are
+# only generated once
+# returns the score, the number of pieces placed, the number of lines cleared and the
+# wall time of the game of each policy
+# with a cache of the states (cfr. State.CACHE), the results also count the hits and misses of
+# the states of each policy
+# with record, the games are also recorded (cfr. Replay.Recorder) with checkpoints every record
+# moves (none when 0), the records are the replay of the results
+def play_games(n, m, policies, agent, seed, sequence=None, record=None):
+    import Tetris
+    agent.rng = random.Random(seed)
+    moves = {policy: Policies.get(policy) for policy in policies}
+    fields = {policy: Tetris.Tetris.FIELD(n, m) for policy in policies}
+    results = {policy: {'policy': policy, 'seed': seed, 'score': 0, 'pieces': 0, 'lines': 0, 'time': 0.0}
+               for policy in policies}
+    cache = State.State.CACHE
+    if cache is not None:
+        for result in results.values():
+            result['cache_hits'] = result['cache_misses'] = 0
+    recorders = {}
+    if record is not None:
+        recorders = {policy: Replay.Recorder(m, seed, policy, record, sequence is not None) for policy in policies}
+
+    tiles = Pieces.Pieces(seed, Tetris.Tetris.PIECES, len(Tetris.Tetris.TILES), sequence)
+    for tile in tiles:
+        if len(fields) == 0:
+            break
+        agent.bag = tiles.bag()
+
+        states = {}
+        for policy, field in list(fields.items()):
+            start = time.time()
+            if cache is not None:
+                hits, misses = cache.hits, cache.misses
+            key = field.key()
+            if key not in states:
+                states[key] = State.State(field, tile)
+            next_move = moves[policy](states[key], agent)
+            if next_move is None:
+                del fields[policy]
+                if recorders:
+                    result = results[policy]
+                    result['replay'] = recorders[policy].finish(result['score'], result['pieces'], result['lines'], tile)
+            else:
+                (field, my_gain, gain) = states[key].successor(next_move)
+                fields[policy] = field
+                results[policy]['score'] += gain
+                results[policy]['pieces'] += 1
+                results[policy]['lines'] += field.cleared
+                if recorders:
+                    recorders[policy].move(tile, next_move, field, results[policy]['score'])
+            if cache is not None:
+                results[policy]['cache_hits'] += cache.hits - hits
+                results[policy]['cache_misses'] += cache.misses - misses
+            results[policy]['time'] += time.time() - start
+
+    for policy in fields:
+        if policy in recorders:
+            result = results[policy]
+            result['replay'] = recorders[policy].finish(result['score'], result['pieces'], result['lines'])
+    return results
+
+
+# plays one game with a policy, cfr. play_games
+def play_game(n, m, policy, w, seed):
+    return play_games(n, m, [policy], Policies.Agent(w), seed)[policy]
+
+
+# unpacks the arguments of a game for the process pool
+def play_task(task):
+    return play_games(*task)
+
+
+# returns the arguments of initialize giving the processes of a pool the settings of this
+# process : the feature set, the piece mode and the field backend
+def settings(cache=None):
+    import Tetris
+    return Field.Field.FEATURES, cache, Tetris.Tetris.PIECES, Tetris.Tetris.FIELD
+
+
+# sets up the processes of the pools (cfr. settings) : they use the feature set, the piece mode
+# and the field backend of the parent process, which are not inherited when the processes are
+# spawned, and with cache, cache their states in a Cache.Cache of that capacity
+def initialize(features, cache=None, pieces=None, field=None):
+    import Tetris
+    Features.use(features)
+    if pieces is not None:
+        Tetris.Tetris.PIECES = pieces
+    if field is not None:
+        Tetris.Tetris.FIELD = field
+    if cache is not None:
+        Cache.enable(cache)
+
+
+# plays the same games with every policy, game i uses the seed seed + i
+# with sequences, a piece sequence file (cfr. Pieces.save), its games are replayed instead, with
+# their seeds when the file has them
+# the agent holds the parameters of the policies, by default the weights w
+# with cache, the states are cached in a Cache.Cache of that capacity in every process
+# with replays, the games are written to that replay file (cfr. Replay.Writer) as they are
+# played, with board checkpoints every checkpoint moves
+# returns the list of game results of each policy, ordered by seed
+def evaluate(n, m, policies, w=None, games=15, seed=0, processes=None, agent=None, cache=None, sequences=None,
+             replays=None, checkpoint=0):
+    if agent is None:
+        agent = Policies.Agent(w)
+    record = None if replays is None else checkpoint
+    if sequences is None:
+        tasks = [(n, m, policies, agent, seed + i, None, record) for i in range(games)]
+    else:
+        tasks = [(n, m, policies, agent, seed + i if stream.seed < 0 else stream.seed, stream.buffer, record)
+                 for i, stream in enumerate(Pieces.load(sequences))]
+
+    results = {policy: [] for policy in policies}
+    writer = None if replays is None else Replay.Writer(replays, n, m, checkpoint)
+    try:
+        if processes == 1:
+            previous = State.State.CACHE
+            if cache is not None:
+                Cache.enable(cache)
+            try:
+                collect(map(play_task, tasks), results, writer)
+            finally:
+                State.State.CACHE = previous
+        else:
+            with multiprocessing.Pool(processes, initialize, settings(cache)) as pool:
+                collect(pool.imap(play_task, tasks), results, writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    return results
+
+
+# adds the results of the games, in the order of the tasks, to those of each policy as they are
+# played, and writes their replays with writer when it is given
+def collect(games, results, writer=None):
+    for game in games:
+        for policy, result in results.items():
+            if writer is not None:
+                writer.write(game[policy].pop('replay'))
+            result.append(game[policy])
+
+
+# returns the mean, standard deviation and 95% confidence interval of the values
+def statistics(values):
+    mean = sum(values) / len(values)
+    std = 0.0
+    if len(values) > 1:
+        std = math.sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))
+    half = 1.96 * std / math.sqrt(len(values))
+    return {'mean': mean, 'std': std, 'ci': (mean - half, mean + half)}
+
+
+# aggregates the game results of every policy, with the hit rate of the cache of the states
+# when the games were played with one
+def summarize(results):
+    summary = {}
+    for policy, games in results.items():
+        summary[policy] = statistics([game['score'] for game in games])
+        summary[policy]['games'] = len(games)
+        for key in ('pieces', 'lines', 'time'):
+            summary[policy][key] = sum(game[key] for game in games) / len(games)
+        if 'cache_hits' in games[0]:
+            hits = sum(game['cache_hits'] for game in games)
+            misses = sum(game['cache_misses'] for game in games)
+            summary[policy]['hit_rate'] = hits / max(1, hits + misses)
+    return summary
+
+
+# records the games and the summary of every policy in metrics (a Metrics.Metrics)
+def record(metrics, results, summary):
+    for policy, games in results.items():
+        for game in games:
+            metrics.log('game', **game)
+        stats = dict(summary[policy])
+        stats['ci_low'], stats['ci_high'] = stats.pop('ci')
+        metrics.log('summary', policy=policy, **stats)
+
+
+def report(summary):
+    print("%-8s %6s %12s %12s %27s %10s %10s %8s" %
+          ('policy', 'games', 'mean', 'std', '95% ci', 'pieces', 'lines', 'time'))
+    for policy, stats in summary.items():
+        print("%-8s %6d %12.1f %12.1f [%12.1f, %12.1f] %10.1f %10.1f %8.2f" %
+              (policy, stats['games'], stats['mean'], stats['std'], stats['ci'][0], stats['ci'][1],
+               stats['pieces'], stats['lines'], stats['time']))
+    for policy, stats in summary.items():
+        if 'hit_rate' in stats:
+            print("%-8s cache hit rate %.1f%%" % (policy, 100 * stats['hit_rate']))
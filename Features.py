@@ -0,0 +1,562 @@
+import functools
+
+import numpy
+
+
+# Kernels of the board features, on the rows given as bitmasks (bit j is the cell of column j,
+# row 0 is the top row).
+# Every kernel takes the rows of one board as a list of integers, or a stack of boards as a
+# NumPy integer array of shape (..., n), and returns an integer, or an array of shape (...).
+# The single boards are handled with bit-parallel operations on the Python integers, the
+# stacks with the same operations on whole arrays at once.
+# The feature sets of the value-function approximation are built on them, cfr. FeatureSet.
+
+
+# returns the number of set bits of every element of the array
+def popcount(a):
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(a).astype(numpy.int64)
+    count = numpy.zeros(a.shape, dtype=numpy.int64)
+    while a.any():
+        count += a & 1
+        a = a >> 1
+    return count
+
+
+# returns the rows of a stack as a (boards x n) int64 array, and the shape of the stack
+def stack(rows):
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    return rows.reshape(-1, rows.shape[-1]), rows.shape[:-1]
+
+
+# returns the cells of the rows of a stack as a (boards x n x m) 0/1 array
+def cells(rows, m):
+    return (rows[..., None] >> numpy.arange(m)) & 1
+
+
+# returns the shadows of the rows : every cell filled or below a filled cell of its column
+def shadows(rows):
+    if isinstance(rows, numpy.ndarray):
+        return numpy.bitwise_or.accumulate(rows, axis=-1)
+    shadow = 0
+    result = []
+    for row in rows:
+        shadow |= row
+        result.append(shadow)
+    return result
+
+
+# returns the height of every column
+def heights(rows, m):
+    if isinstance(rows, numpy.ndarray):
+        return cells(shadows(rows), m).sum(axis=-2)
+    n = len(rows)
+    result = [0] * m
+    remaining = (1 << m) - 1
+    for i in range(0, n):
+        hit = rows[i] & remaining
+        while hit:
+            low = hit & -hit
+            result[low.bit_length() - 1] = n - i
+            hit ^= low
+        remaining &= ~rows[i]
+        if remaining == 0:
+            break
+    return result
+
+
+# returns the sum of the height differences of the adjacent columns
+def bumpiness(rows, m):
+    h = heights(rows, m)
+    if isinstance(h, numpy.ndarray):
+        return numpy.abs(numpy.diff(h, axis=-1)).sum(axis=-1)
+    return sum(abs(h[j] - h[j+1]) for j in range(0, m-1))
+
+
+# returns the number of empty cells below the top cell of their column
+def covered_cells(rows, m):
+    if isinstance(rows, numpy.ndarray):
+        return popcount(shadows(rows) & ~rows).sum(axis=-1)
+    covered = 0
+    shadow = 0
+    for row in rows:
+        shadow |= row
+        covered += (shadow & ~row).bit_count()
+    return covered
+
+
+# returns the number of filled/empty changes along the rows of the pile, the walls being filled
+# the empty rows above the pile are not counted
+def row_transitions(rows, m):
+    walls = 1 | (1 << (m+1))
+    pairs = (1 << (m+1)) - 1
+    if isinstance(rows, numpy.ndarray):
+        extended = (rows << 1) | walls
+        transitions = popcount((extended ^ (extended >> 1)) & pairs)
+        return numpy.where(shadows(rows) != 0, transitions, 0).sum(axis=-1)
+    transitions = 0
+    shadow = 0
+    for row in rows:
+        shadow |= row
+        if shadow == 0:
+            continue
+        extended = (row << 1) | walls
+        transitions += ((extended ^ (extended >> 1)) & pairs).bit_count()
+    return transitions
+
+
+# returns the number of filled/empty changes along the columns, the floor being filled
+def column_transitions(rows, m):
+    full = (1 << m) - 1
+    if isinstance(rows, numpy.ndarray):
+        return popcount(rows[..., :-1] ^ rows[..., 1:]).sum(axis=-1) + popcount(~rows[..., -1] & full)
+    transitions = ((rows[-1] ^ full) & full).bit_count()
+    for i in range(0, len(rows)-1):
+        transitions += (rows[i] ^ rows[i+1]).bit_count()
+    return transitions
+
+
+# returns the masks of the well cells of the rows : the empty cells above the top of their
+# column whose left and right neighbours are filled (or walls)
+def well_cells(rows, m):
+    full = (1 << m) - 1
+    walls = 1 | (1 << (m+1))
+    if isinstance(rows, numpy.ndarray):
+        extended = (rows << 1) | walls
+        return ~shadows(rows) & full & extended & (extended >> 2)
+    result = []
+    for row, shadow in zip(rows, shadows(rows)):
+        extended = (row << 1) | walls
+        result.append(~shadow & full & extended & (extended >> 2))
+    return result
+
+
+# returns the cumulative depth of the wells : a well of depth d counts 1 + 2 + ... + d
+def wells(rows, m):
+    masks = well_cells(rows, m)
+    if isinstance(masks, numpy.ndarray):
+        well = cells(masks, m)
+        depth = numpy.zeros(well.shape[:-2] + (m,), dtype=numpy.int64)
+        total = numpy.zeros(well.shape[:-2], dtype=numpy.int64)
+        for i in range(0, well.shape[-2]):
+            depth = (depth + 1) * well[..., i, :]
+            total += depth.sum(axis=-1)
+        return total
+
+    # runs[k] holds the columns where the well cells of the row have at least k well cells above
+    total = 0
+    runs = []
+    for mask in masks:
+        next = [mask] if mask else []
+        for run in runs:
+            run &= mask
+            if run == 0:
+                break
+            next.append(run)
+        runs = next
+        total += sum(run.bit_count() for run in runs)
+    return total
+
+
+# returns the number of rows having at least one empty cell below the top of its column
+def rows_with_holes(rows, m):
+    if isinstance(rows, numpy.ndarray):
+        return ((shadows(rows) & ~rows) != 0).sum(axis=-1)
+    return sum(1 for row, shadow in zip(rows, shadows(rows)) if shadow & ~row)
+
+
+# returns the sum over the empty cells below the top of their column of the number of filled
+# cells above them in the column
+# the filled cells above every column are counted in binary, counts[k] holding bit k of the
+# count of every column
+def hole_depth(rows, m):
+    if isinstance(rows, numpy.ndarray):
+        filled = cells(rows, m)
+        above = numpy.cumsum(filled, axis=-2) - filled
+        return (cells(shadows(rows) & ~rows, m) * above).sum(axis=(-2, -1))
+    depth = 0
+    counts = []
+    shadow = 0
+    for row in rows:
+        shadow |= row
+        covered = shadow & ~row
+        if covered:
+            depth += sum((covered & count).bit_count() << k for k, count in enumerate(counts))
+        carry = row
+        k = 0
+        while carry:
+            if k == len(counts):
+                counts.append(0)
+            counts[k], carry = counts[k] ^ carry, counts[k] & carry
+            k += 1
+    return depth
+
+
+# removes from the cells the group of cells connected to the seed, a subset of cells[i]
+# every row reached is filled along its runs of cells at once, and only its neighbours are visited
+def fill(cells, i, seed):
+    n = len(cells)
+    pending = [(i, seed)]
+    while pending:
+        i, grown = pending.pop()
+        grown &= cells[i]
+        if grown == 0:
+            continue
+        while True:
+            spread = (grown | (grown << 1) | (grown >> 1)) & cells[i]
+            if spread == grown:
+                break
+            grown = spread
+        cells[i] &= ~grown
+        if i > 0:
+            pending.append((i-1, grown))
+        if i < n-1:
+            pending.append((i+1, grown))
+
+
+# grows the regions of a (boards x n) stack to all the cells of empty connected to them
+def flood_stack(region, empty):
+    while True:
+        grown = region | (region << 1) | (region >> 1)
+        grown[:, 1:] |= region[:, :-1]
+        grown[:, :-1] |= region[:, 1:]
+        grown &= empty
+        if numpy.array_equal(grown, region):
+            return region
+        region = grown
+
+
+# returns the number of connected groups of empty cells that cannot be reached from the top row
+def connected_holes(rows, m):
+    full = (1 << m) - 1
+    if isinstance(rows, numpy.ndarray):
+        rows, shape = stack(rows)
+        empty = ~rows & full
+        top = numpy.zeros_like(empty)
+        top[:, 0] = empty[:, 0]
+        left = empty & ~flood_stack(top, empty)
+
+        # floods one group of every board still having some, from its first cell, the boards
+        # without any left being dropped
+        holes = numpy.zeros(len(rows), dtype=numpy.int64)
+        boards = numpy.flatnonzero(left.any(axis=1))
+        left = left[boards]
+        while len(boards):
+            first = numpy.argmax(left != 0, axis=1)
+            index = numpy.arange(len(boards))
+            seed = numpy.zeros_like(left)
+            seed[index, first] = left[index, first] & -left[index, first]
+            left &= ~flood_stack(seed, left)
+            holes[boards] += 1
+            remaining = left.any(axis=1)
+            boards = boards[remaining]
+            left = left[remaining]
+        return holes.reshape(shape)
+
+    # the empty cells reached from the top row are removed first, then one group at a time
+    left = [~row & full for row in rows]
+    fill(left, 0, left[0])
+    holes = 0
+    for i in range(0, len(left)):
+        while left[i]:
+            fill(left, i, left[i] & -left[i])
+            holes += 1
+
+    return holes
+
+
+# Stack of boards given to the feature sets : their rows (..., n) and, when they are already
+# known, their column heights (..., m) and covered cells (...). The boards reached by a move
+# also come with the landing height of the tile and the number of its cells eroded (...).
+class Boards:
+
+    def __init__(self, rows, m, heights=None, covered=None, landing=None, eroded=None):
+        self.masks = rows
+        self.shape = numpy.shape(rows)[:-1]
+        self.n = numpy.shape(rows)[-1]
+        self.m = m
+        self.landing = landing
+        self.eroded = eroded
+        if heights is not None:
+            self.heights = heights
+        if covered is not None:
+            self.covered = covered
+
+    # the rows as int64, converted when a feature reads them
+    @functools.cached_property
+    def rows(self):
+        return numpy.asarray(self.masks, dtype=numpy.int64)
+
+    @functools.cached_property
+    def heights(self):
+        return heights(self.rows, self.m)
+
+    @functools.cached_property
+    def covered(self):
+        return covered_cells(self.rows, self.m)
+
+
+# A feature of the value-function approximation, of size values :
+#   expression : its values in the extractor of one field, cfr. FeatureSet.compile
+#   passes     : the accumulators of the pass over the rows it reads, cfr. PASSES
+#   stack      : its values (..., size) or (...) on a stack of Boards
+class Feature:
+
+    def __init__(self, name, expression, stack, size=1, passes=()):
+        self.name = name
+        self.expression = expression
+        self.stack = stack
+        self.size = size
+        self.passes = passes
+
+    # returns the number of values of the feature on a board of m columns
+    def dimension(self, m):
+        return self.size(m) if callable(self.size) else self.size
+
+
+FEATURES = {}
+
+
+# registers the decorated stack function as the feature name
+def register(name, expression, size=1, passes=()):
+    def decorator(stack):
+        FEATURES[name] = Feature(name, expression, stack, size, passes)
+        return stack
+    return decorator
+
+
+# Accumulators of the pass over the rows of the extractors : the accumulators they read first,
+# then their lines before the pass, in the pass and after it. In the pass, row is the current
+# row and shadow the union of the rows up to it.
+PASSES = {
+    'rows': ((), [], [], []),
+    'extended': ((), ['walls = 1 | (1 << (m+1))'], ['extended = (row << 1) | walls'], []),
+    'covered': ((), [], ['covered = shadow & ~row'], []),
+    'row_transitions': (('extended',), ['row_transitions = 0', 'pairs = (1 << (m+1)) - 1'], [
+        'if shadow:',
+        '    row_transitions += ((extended ^ (extended >> 1)) & pairs).bit_count()',
+    ], []),
+    'column_transitions': ((), ['column_transitions = 0', 'previous = rows[0]'], [
+        'column_transitions += (previous ^ row).bit_count()',
+        'previous = row',
+    ], ['column_transitions += (~previous & full).bit_count()']),
+    'wells': (('extended',), ['wells = 0', 'runs = []'], [
+        'well = ~shadow & full & extended & (extended >> 2)',
+        'if well:',
+        '    deeper = [well]',
+        '    for run in runs:',
+        '        run &= well',
+        '        if run == 0:',
+        '            break',
+        '        deeper.append(run)',
+        '    runs = deeper',
+        '    wells += sum([run.bit_count() for run in runs])',
+        'elif runs:',
+        '    runs = []',
+    ], []),
+    'rows_with_holes': (('covered',), ['rows_with_holes = 0'], [
+        'if covered:',
+        '    rows_with_holes += 1',
+    ], []),
+    'hole_depth': (('covered',), ['hole_depth = 0', 'counts = []'], [
+        'if covered:',
+        '    hole_depth += sum([(covered & count).bit_count() << k for k, count in enumerate(counts)])',
+        'carry = row',
+        'k = 0',
+        'while carry:',
+        '    if k == len(counts):',
+        '        counts.append(0)',
+        '    counts[k], carry = counts[k] ^ carry, counts[k] & carry',
+        '    k += 1',
+    ], []),
+}
+
+
+# the features of the value-function approximation, the expressions can read the field, its
+# rows (when a pass is needed), its accessible list, n, m and full
+# the heights and the bumpiness are read from the field, BitField keeps them up to date
+
+@register('height_differences', '[accessible[j] - accessible[j+1] for j in range(0, m-1)]', lambda m: m - 1)
+def stack_height_differences(boards):
+    return numpy.diff(boards.heights, axis=-1)
+
+
+@register('max_height', 'field.highest')
+def stack_max_height(boards):
+    return boards.heights.max(axis=-1)
+
+
+# minimum height of the non-empty columns, n on the empty board
+@register('min_height', 'field.lowest')
+def stack_min_height(boards):
+    return numpy.where(boards.heights > 0, boards.heights, boards.n).min(axis=-1)
+
+
+# number of covered cells
+@register('holes', 'field.n_inaccessibles()')
+def stack_holes(boards):
+    return boards.covered
+
+
+@register('average_height', 'field.average')
+def stack_average_height(boards):
+    return boards.heights.sum(axis=-1) / boards.m
+
+
+@register('bumpiness', 'field.bumpiness')
+def stack_bumpiness(boards):
+    return numpy.abs(numpy.diff(boards.heights, axis=-1)).sum(axis=-1)
+
+
+@register('connected_holes', 'connected_holes(rows, m)', passes=('rows',))
+def stack_connected_holes(boards):
+    return connected_holes(boards.rows, boards.m)
+
+
+@register('row_transitions', 'row_transitions', passes=('row_transitions',))
+def stack_row_transitions(boards):
+    return row_transitions(boards.rows, boards.m)
+
+
+@register('column_transitions', 'column_transitions', passes=('column_transitions',))
+def stack_column_transitions(boards):
+    return column_transitions(boards.rows, boards.m)
+
+
+@register('wells', 'wells', passes=('wells',))
+def stack_wells(boards):
+    return wells(boards.rows, boards.m)
+
+
+@register('rows_with_holes', 'rows_with_holes', passes=('rows_with_holes',))
+def stack_rows_with_holes(boards):
+    return rows_with_holes(boards.rows, boards.m)
+
+
+@register('hole_depth', 'hole_depth', passes=('hole_depth',))
+def stack_hole_depth(boards):
+    return hole_depth(boards.rows, boards.m)
+
+
+# height of the middle of the last tile placed
+@register('landing_height', 'field.landing')
+def stack_landing_height(boards):
+    if boards.landing is None:
+        raise ValueError("the boards were not reached by a move, they have no landing height")
+    return boards.landing
+
+
+# number of cells of the last tile removed with the rows it cleared, times the rows cleared
+@register('eroded_cells', 'field.eroded')
+def stack_eroded_cells(boards):
+    if boards.eroded is None:
+        raise ValueError("the boards were not reached by a move, they have no eroded cells")
+    return boards.eroded
+
+
+# named feature sets : the features of Field.features before the feature sets, the features
+# of Dellacherie and those of the BCTS controller of Thiery and Scherrer
+SETS = {
+    'default': ('height_differences', 'max_height', 'min_height', 'holes', 'average_height'),
+    'dellacherie': ('landing_height', 'eroded_cells', 'row_transitions', 'column_transitions', 'holes',
+                    'wells'),
+    'bcts': ('landing_height', 'eroded_cells', 'row_transitions', 'column_transitions', 'holes', 'wells',
+             'hole_depth', 'rows_with_holes'),
+}
+
+
+# Ordered list of features, the feature vector being the concatenation of their values.
+# The extractor of one field is compiled into a single function doing one pass over the
+# rows for all the accumulators the features need, and none when they need no accumulator.
+# The set is known by its name in SETS, or by its features separated with commas.
+class FeatureSet:
+
+    def __init__(self, features, name=None):
+        for feature in features:
+            if feature not in FEATURES:
+                raise ValueError("unknown feature %s, expected one of %s" % (feature, ', '.join(FEATURES)))
+        self.features = tuple(features)
+        self.name = ','.join(self.features) if name is None else name
+        self.extract = self.compile()
+
+    # the compiled extractor is rebuilt from the features in the other processes
+    def __reduce__(self):
+        return FeatureSet, (self.features, self.name)
+
+    def __repr__(self):
+        return 'FeatureSet(%s)' % self.name
+
+    # returns the dimension of the feature (and weight) vector on a board of m columns
+    def dimension(self, m):
+        return sum(FEATURES[feature].dimension(m) for feature in self.features)
+
+    # returns the index of the first value of the feature in the feature vector
+    def index(self, feature, m):
+        return sum(FEATURES[other].dimension(m) for other in self.features[:self.features.index(feature)])
+
+    # returns the source of the extractor, a function of the field returning its feature vector
+    def source(self):
+        passes = []
+
+        def require(name):
+            if name not in passes:
+                for other in PASSES[name][0]:
+                    require(other)
+                passes.append(name)
+
+        for feature in self.features:
+            for name in FEATURES[feature].passes:
+                require(name)
+
+        lines = ['def extract(field):',
+                 '    accessible = field.accessible',
+                 '    n = field.n',
+                 '    m = field.m',
+                 '    full = (1 << m) - 1']
+        if passes:
+            lines.append('    rows = field.row_masks()')
+            for name in passes:
+                lines += ['    ' + line for line in PASSES[name][1]]
+            lines += ['    shadow = 0', '    for row in rows:', '        shadow |= row']
+            for name in passes:
+                lines += ['        ' + line for line in PASSES[name][2]]
+            for name in passes:
+                lines += ['    ' + line for line in PASSES[name][3]]
+
+        values = []
+        for feature in self.features:
+            feature = FEATURES[feature]
+            values.append(feature.expression if feature.size == 1 else '*' + feature.expression)
+        lines.append('    return [%s]' % ', '.join(values))
+        return '\n'.join(lines) + '\n'
+
+    # compiles the extractor
+    def compile(self):
+        namespace = {}
+        exec(compile(self.source(), '<features %s>' % self.name, 'exec'), globals(), namespace)
+        return namespace['extract']
+
+    # returns the feature vectors (..., dimension) of a stack of Boards
+    def extract_stack(self, boards):
+        values = [numpy.asarray(FEATURES[feature].stack(boards), dtype=float).reshape(boards.shape + (-1,))
+                  for feature in self.features]
+        return numpy.concatenate(values, axis=-1)
+
+
+# returns the feature set of the name in SETS, of the features given as a list or separated
+# with commas, or the given FeatureSet
+def get(features):
+    if isinstance(features, FeatureSet):
+        return features
+    if isinstance(features, str):
+        if features in SETS:
+            return FeatureSet(SETS[features], features)
+        features = features.split(',')
+    return FeatureSet(features)
+
+
+# makes the fields of this process use the feature set (cfr. get) and returns it
+def use(features):
+    import Field
+    Field.Field.FEATURES = get(features)
+    return Field.Field.FEATURES
@@ -1,11 +1,23 @@
+import Features
+import Learner
+import operator
+
+
 class Field:
 
-    def __init__(self, n, m, grid=None, accessible=None, color=None):
+    # features of the value-function approximation, cfr. Features.use
+    FEATURES = Features.get('default')
+
+    # colors are always kept by this backend, colored is only there for compatibility
+    def __init__(self, n, m, grid=None, accessible=None, color=None, colored=True):
         self.n = n
         self.m = m
         self.grid = grid
         self.accessible = accessible
         self.color = color
+        self.cleared = 0 # rows cleared by the last tile
+        self.landing = 0 # height of the middle of the last tile
+        self.eroded = 0  # cells of the last tile cleared, times the rows cleared
 
         if grid is None:
             self.grid = [[0 for x in range(self.m)] for y in range(self.n)]
@@ -29,11 +41,36 @@ class Field:
 
     # returns the exact representation of the grid
     def representation(self):
-        hashes = ()
+        return self.key()
+
+    # returns the rows packed in one integer, the top row in the most significant bits
+    # cfr. BitField.from_key
+    def key(self):
+        key = 0
         for row in self.grid:
-            hashes += (tuple(row).__hash__(),)
-        return hashes.__hash__()
-        # return tuple(self.accessible).__hash__()
+            for j in range(self.m-1, -1, -1):
+                key = (key << 1) | row[j]
+        return key
+
+    # maximum height of a column
+    @property
+    def highest(self):
+        return self.n - min(self.accessible)
+
+    # minimum height of the non-empty columns, n on the empty board
+    @property
+    def lowest(self):
+        return self.n - max([acc for acc in self.accessible if acc < self.n], default=0)
+
+    # average height of the columns
+    @property
+    def average(self):
+        return (self.n * self.m - sum(self.accessible)) / self.m
+
+    # sum of the height differences of the adjacent columns
+    @property
+    def bumpiness(self):
+        return sum([abs(self.accessible[j] - self.accessible[j+1]) for j in range(0, self.m-1)])
 
     # returns the maximum height of a column and the average height
     def max_height(self):
@@ -52,66 +89,28 @@ class Field:
 
         return max_height, sum / self.m
 
+    # returns the feature vector of the value-function approximation
+    def features(self):
+        return self.FEATURES.extract(self)
+
     # returns the value-function approximation and its gradient
     def utility(self, w):
-        max_height = 0
-        min_height = self.n
-        heights = [0 for j in range(0, self.m)]
-
-        for i in range(0, self.n):
-            for j in range(0, self.m):
-                if self.grid[i][j] == 1:
-                    heights[j] = max(heights[j], self.n-i)
-                    max_height = max(max_height, heights[j])
-                    min_height = min(min_height, heights[j])
-
+        gradient = self.features()
         u = 0
-        gradient = []
-        # for j in range(0, self.m):
-        #     u += w[j] * heights[j] #/ self.n
-        #     gradient.append(heights[j]) # / self.n)
-
-        avg_height = heights[0]
-        for j in range(0, self.m-1):
-            u += w[j] * (heights[j+1]-heights[j]) #/ self.n
-            gradient.append((heights[j + 1] - heights[j]))# / self.n)
-            avg_height += heights[j+1]
-        avg_height /= self.m
-
-        n_holes = self.n_inaccessibles()
-
-        u += w[self.m - 1] * max_height #/ self.n
-        u += w[self.m - 1] * min_height #/ self.n
-        u += w[self.m + 1] * n_holes #/ (self.n * self.m)
-        u += w[self.m + 2] * avg_height
-
-        gradient.append(max_height) #/ self.n)
-        gradient.append(min_height) #/ self.n)
-        gradient.append(n_holes )#/ (self.n * self.m))
-        gradient.append(avg_height)
-
+        for i in range(self.dimension()):
+            u += w[i] * gradient[i]
         return u, gradient
 
     # updates the value-function approximation
     # cfr. n-step semi-gradient TD
     def utility_update(self, w, alpha, G):
-        new_w = [0 for i in range(self.dimension())]
-        est_utility, gradient = self.utility(w)
-        absmax = 0
-
-        for i in range(self.dimension()):
-            new_w[i] = w[i] + alpha * (G - est_utility) * gradient[i]
-            absmax = max(absmax, abs(new_w[i]))
-
-        if absmax != 0:
-            for i in range(self.dimension()):
-                new_w[i] /= absmax
-
-        return new_w
+        learner = Learner.Learner(w)
+        learner.update(self.features(), G, alpha)
+        return learner.weights()
 
     # returns the dimension of the feature (and weight) vector
     def dimension(self):
-        return self.m + 3
+        return self.FEATURES.dimension(self.m)
 
     # sets the cell (i, j) to the color
     def set(self, i, j, color):
@@ -137,32 +136,31 @@ class Field:
 
     # returns all the positions where the tile and its rotations can be places
     def positions(self, cardinal_tile):
-        pos = {}
-        for rot in range(0, 4):
+        pos = []
+        for rot in cardinal_tile.distinct:
             tile = cardinal_tile.rotation(rot)
+            drops = {}
             for i in range(0, self.n-tile.n+1):
                 for j in range(0, self.m-tile.m+1):
                     if self.can_place(tile, i, j):
-                        pos[(j,rot)] = (i, j, rot)
-
-            for z in range(0, self.m): # shift tiles when at bottom
-                if (z, rot) in pos:
-                    (i, oj, _) = pos[(z,rot)]
-                    j = oj
-                    while j > 0 and (j-1, rot) not in pos:
-                        j -= 1
-                        if self.can_shift(tile, i, j):
-                            pos[(j, rot)] = (i, j, rot)
-                        else:
-                            break
-                    j = oj
-                    while j < self.m-1-tile.m and (j+1, rot) not in pos:
-                        j += 1
-                        if self.can_shift(tile, i, j):
-                            pos[(j, rot)] = (i, j, rot)
-                        else:
-                            break
-        return list(pos.values())
+                        drops[j] = i
+
+            # shift tiles when at bottom, the lowest shift is kept when several reach the same column
+            shifts = {}
+            for oj, i in drops.items():
+                for step in (-1, 1):
+                    j = oj + step
+                    while 0 <= j <= self.m-tile.m and j not in drops and self.can_shift(tile, i, j):
+                        if shifts.get(j, -1) < i:
+                            shifts[j] = i
+                        j += step
+
+            for j in range(0, self.m-tile.m+1):
+                if j in drops:
+                    pos.append((drops[j], j, rot))
+            for j, i in sorted(shifts.items()):
+                pos.append((i, j, rot))
+        return pos
 
     # returns the grid after setting the tile w.r.t. the move
     # also returns the reward and the game gain
@@ -181,6 +179,11 @@ class Field:
                 if tile.get(k, l) == 1:
                     self.set(i+k, j+l, tile.color)
 
+        eroded = 0
+        for k in range(0, tile.n):
+            if 0 not in self.grid[i+k]:
+                eroded += sum(tile.get(k, l) for l in range(0, tile.m))
+
         row = self.n-1
         count = 0
         while row >= 0:
@@ -207,6 +210,9 @@ class Field:
         else:
             value += 3 * (prev_avg - avg)
 
+        self.cleared = count
+        self.landing = self.n - i - (tile.n - 1) / 2
+        self.eroded = count * eroded
         import Tetris
         return value, 100 * ((count * Tetris.Tetris.ROW_GAIN) ** 2)
 
@@ -225,50 +231,19 @@ class Field:
                 if self.grid[i][j] == 1:
                     self.accessible[j] = min(self.accessible[j], i)
 
-    # computes the number of holes
-    def n_holes(self):
-        holes = 0
-        self.vis = [[False for x in range(self.m)] for y in range(self.n)]
-        for i in range(1, self.n):
-            for j in range(0, self.m):
-                if self.grid[i][j] == 0 and not self.vis[i][j]:
-                    if not self.dfs(i, j):
-                        holes += 1
+    # returns the rows as bitmasks, bit j being the cell of column j
+    def row_masks(self):
+        shifts = range(self.m)
+        return [sum(map(operator.lshift, row, shifts)) for row in self.grid]
 
-        return holes
+    # computes the number of holes : the groups of empty cells that cannot be reached from the top
+    def n_holes(self):
+        return Features.connected_holes(self.row_masks(), self.m)
 
-    # computes the number of inaccessible cells
+    # computes the number of inaccessible cells : the cells below the top of the columns which
+    # are not filled, cfr. Features.covered_cells
     def n_inaccessibles(self):
-        holes = 0
-        for i in range(0, self.n):
-            for j in range(0, self.m):
-                if self.grid[i][j] == 0 and i >= self.accessible[j]:
-                    holes += 1
-
-        return holes
-
-    # help function for n_holes
-    def dfs(self, i, j):
-        if i < 0 or i >= self.n or j < 0 or j >= self.m:
-            return False
-        if self.vis[i][j]:
-            return False
-        if self.grid[i][j] == 1:
-            return False
-
-        self.vis[i][j] = True
-        if self.dfs(i-1, j):
-            return True
-        if self.dfs(i+1, j):
-            return True
-        if self.dfs(i, j-1):
-            return True
-        if self.dfs(i, j+1):
-            return True
-        if i == 0:
-            return True
-
-        return False
+        return self.n * self.m - sum(self.accessible) - sum(map(sum, self.grid))
 
     def print(self):
         for i in range(self.n):
@@ -0,0 +1,153 @@
+import argparse
+import functools
+import json
+import time
+import tracemalloc
+
+import BitField
+import Field
+import Learner
+import State
+
+
+# methods instrumented by default, on every class defining them
+TARGETS = [
+    (Field.Field, 'positions'), (BitField.BitField, 'positions'),
+    (Field.Field, 'successor'),
+    (Field.Field, 'set_tile'), (BitField.BitField, 'set_tile'),
+    (Field.Field, 'remove_row'), (BitField.BitField, 'remove_row'),
+    (Field.Field, 'features'),
+    (Field.Field, 'utility'),
+    (Field.Field, 'utility_update'),
+    (Learner.Learner, 'update'), (Learner.Learner, 'update_batch'),
+    (State.State, '__init__'),
+]
+
+
+# Opt-in instrumentation of the hot paths.
+# While enabled, the target methods are replaced by wrappers counting their calls, their
+# cumulative time (nested calls included) and, with allocations, the memory they allocate
+# and keep (measured with tracemalloc, which slows the run down). Disabled, the original
+# methods are restored, so that there is no overhead at all.
+# With sample k, only one call in k is timed and the times are extrapolated to all the
+# calls, for long runs. The counters only see the calls of this process : instrument the
+# runs with processes=1.
+class Instrumentation:
+
+    def __init__(self, targets=None, sample=1, allocations=False):
+        self.targets = TARGETS if targets is None else targets
+        self.sample = sample
+        self.allocations = allocations
+        self.originals = []
+        self.counters = {}
+        self.elapsed = 0
+        self.tracing = False # whether tracemalloc was started by this instrumentation
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def enable(self):
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        for cls, name in self.targets:
+            if name in cls.__dict__:
+                method = cls.__dict__[name]
+                self.originals.append((cls, name, method))
+                setattr(cls, name, self.wrap('%s.%s' % (cls.__name__, name), method))
+        self.start = time.perf_counter()
+
+    def disable(self):
+        self.elapsed += time.perf_counter() - self.start
+        for cls, name, method in reversed(self.originals):
+            setattr(cls, name, method)
+        self.originals = []
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    # returns the wrapper of the method, its counter is [calls, timed calls, seconds, bytes]
+    def wrap(self, name, method):
+        counter = self.counters.setdefault(name, [0, 0, 0.0, 0])
+        sample = self.sample
+        allocations = self.allocations
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            counter[0] += 1
+            if counter[0] % sample != 0:
+                return method(*args, **kwargs)
+
+            if allocations:
+                memory = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            counter[2] += time.perf_counter() - start
+            if allocations:
+                counter[3] += tracemalloc.get_traced_memory()[0] - memory
+            counter[1] += 1
+            return result
+
+        return wrapper
+
+    # returns the statistics of every instrumented method, the times are extrapolated from
+    # the timed calls
+    def summary(self):
+        elapsed = self.elapsed
+        if self.originals:
+            elapsed += time.perf_counter() - self.start
+        methods = {}
+        for name, (calls, timed, seconds, allocated) in self.counters.items():
+            if calls == 0:
+                continue
+            scale = calls / timed if timed else 0
+            methods[name] = {'calls': calls, 'timed': timed, 'seconds': seconds * scale,
+                             'us_per_call': 1e6 * seconds / timed if timed else 0,
+                             'share': seconds * scale / elapsed if elapsed else 0}
+            if self.allocations:
+                methods[name]['bytes'] = allocated * scale
+        return {'elapsed': elapsed, 'sample': self.sample, 'methods': methods}
+
+    def report(self):
+        summary = self.summary()
+        columns = "%-26s %10s %10s %12s %8s" + (" %12s" if self.allocations else "")
+        names = ('method', 'calls', 'seconds', 'us/call', 'share') + (('KiB kept',) if self.allocations else ())
+        print(columns % names)
+        for name, stats in sorted(summary['methods'].items(), key=lambda item: -item[1]['seconds']):
+            row = "%-26s %10d %10.3f %12.1f %7.1f%%" % (name, stats['calls'], stats['seconds'],
+                                                        stats['us_per_call'], 100 * stats['share'])
+            if self.allocations:
+                row += " %12.1f" % (stats['bytes'] / 1024)
+            print(row)
+        print("Wall time : %.3f s (times are inclusive of nested calls)" % summary['elapsed'])
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Instrumented run of the learning or the evaluation')
+    parser.add_argument('run', choices=['learn', 'compare'])
+    parser.add_argument('--size', type=int, nargs=2, default=(20, 10), metavar=('N', 'M'))
+    parser.add_argument('--sample', type=int, default=1, help='time one call in SAMPLE')
+    parser.add_argument('--allocations', action='store_true', help='measure the allocations (slow)')
+    parser.add_argument('--json', help='write the summary to this JSON file')
+    args = parser.parse_args()
+
+    import Tetris
+    game = Tetris.Tetris(*args.size)
+    game.w = [0.0] * game.FIELD(*args.size).dimension()
+    with Instrumentation(sample=args.sample, allocations=args.allocations) as instrumentation:
+        if args.run == 'learn':
+            game.learn()
+        else:
+            game.compare_perf(processes=1)
+
+    instrumentation.report()
+    if args.json:
+        instrumentation.write(args.json)
@@ -0,0 +1,51 @@
+import numpy
+
+
+# Linear value function trained with the n-step semi-gradient TD update of
+# Field.utility_update : w <- w + alpha * (G - w.x) * x, then w is divided by its largest
+# absolute weight (when it is not 0). The weights are updated in place.
+class Learner:
+
+    def __init__(self, w):
+        self.w = numpy.array(w, dtype=float)
+        self.step = numpy.empty_like(self.w)
+
+    # returns the weights as a list
+    def weights(self):
+        return self.w.tolist()
+
+    # returns the euclidean norm of the weights
+    def norm(self):
+        return float(numpy.linalg.norm(self.w))
+
+    # returns the value of a feature vector
+    def value(self, features):
+        return float(numpy.dot(self.w, features))
+
+    def normalize(self):
+        absmax = numpy.abs(self.w, out=self.step).max()
+        if absmax != 0:
+            self.w /= absmax
+
+    # applies the update of one target G of the features
+    def update(self, features, G, alpha):
+        features = numpy.asarray(features, dtype=float)
+        numpy.multiply(features, alpha * (G - numpy.dot(self.w, features)), out=self.step)
+        self.w += self.step
+        self.normalize()
+
+    # applies the updates of the targets (features, G) one after the other
+    def apply(self, targets, alpha):
+        for features, G in targets:
+            self.update(features, G, alpha)
+
+    # applies the updates of a minibatch at once : the errors of all the targets are measured
+    # with the current weights, their updates are summed and the weights normalized once
+    # features is a matrix with one row per target and G the vector of the targets
+    def update_batch(self, features, G, alpha):
+        features = numpy.asarray(features, dtype=float)
+        if len(features) == 0:
+            return
+        errors = alpha * (numpy.asarray(G, dtype=float) - features @ self.w)
+        self.w += errors @ features
+        self.normalize()
@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+
+# Sink of the metrics of training and evaluation runs.
+# Every record is an event name with values, stamped with its sequence number and the
+# seconds since the sink was opened. The records are buffered and written by a background
+# thread, as JSON lines, or with format csv in one CSV file per event (path.event.csv).
+# The records above the verbosity level are dropped : hot loops should test wants(level)
+# before building them, so that nothing is formatted when they are not wanted.
+class Metrics:
+
+    OFF = 0
+    SUMMARY = 1  # episodes, value-iteration sweeps, games
+    STEP = 2     # every piece of the episodes
+
+    def __init__(self, path, format=None, level=SUMMARY, buffer=256):
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'jsonl'
+        self.path = path
+        self.format = format
+        self.level = level
+        self.buffer = buffer
+        self.pending = []
+        self.sequence = 0
+        self.start = time.time()
+        self.files = {}
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # tells whether the records of the level are kept
+    def wants(self, level):
+        return level <= self.level
+
+    # records an event with the values
+    def log(self, event, level=SUMMARY, **values):
+        if level > self.level:
+            return
+        self.sequence += 1
+        values['event'] = event
+        values['seq'] = self.sequence
+        values['elapsed'] = time.time() - self.start
+        self.pending.append(values)
+        if len(self.pending) >= self.buffer:
+            self.flush()
+
+    # hands the buffered records over to the writer thread
+    def flush(self):
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
+
+    # writes the remaining records and closes the files
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    # writer thread
+    def run(self):
+        try:
+            while True:
+                records = self.queue.get()
+                if records is None:
+                    break
+                for record in records:
+                    self.write(record)
+                for f, writer in self.files.values():
+                    f.flush()
+        finally:
+            for f, writer in self.files.values():
+                f.close()
+
+    def write(self, record):
+        if self.format == 'jsonl':
+            if None not in self.files:
+                self.files[None] = (open(self.path, 'a'), None)
+            self.files[None][0].write(json.dumps(record, default=lambda value: value.item()) + '\n')
+            return
+
+        event = record['event']
+        if event not in self.files:
+            root, extension = os.path.splitext(self.path)
+            f = open('%s.%s%s' % (root, event, extension or '.csv'), 'a', newline='')
+            writer = csv.DictWriter(f, list(record), extrasaction='ignore')
+            if f.tell() == 0:
+                writer.writeheader()
+            self.files[event] = (f, writer)
+        self.files[event][1].writerow(record)
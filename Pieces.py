@@ -0,0 +1,121 @@
+import struct
+
+import numpy
+
+
+# tiles drawn by bags holding every tile once, or independently
+MODES = ['bag', 'uniform']
+
+
+# Stream of the tiles of a game, which only depends on its seed.
+# The tiles are generated in bulk with a NumPy generator, CHUNK bags (or as many tiles in
+# uniform mode) at a time, and kept as bytes, one tile per byte. With sequence (bytes), the
+# stream replays the given tiles instead and ends after them.
+class Pieces:
+
+    CHUNK = 64
+
+    def __init__(self, seed=0, mode='bag', n_tiles=7, sequence=None):
+        if mode not in MODES:
+            raise ValueError("unknown piece mode %s, expected one of %s" % (mode, ', '.join(MODES)))
+        self.seed = seed
+        self.mode = mode
+        self.n_tiles = n_tiles
+        self.rng = numpy.random.default_rng(seed) if sequence is None else None
+        self.buffer = b'' if sequence is None else bytes(sequence)
+        self.start = 0    # index in the game of the first tile of the buffer
+        self.position = 0 # index in the buffer of the next tile
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position == len(self.buffer):
+            self.refill()
+        tile = self.buffer[self.position]
+        self.position += 1
+        return tile
+
+    # number of tiles drawn
+    def drawn(self):
+        return self.start + self.position
+
+    # replaces the buffer, once read, by the next chunk of tiles
+    def refill(self):
+        if self.rng is None:
+            raise StopIteration
+        self.start += len(self.buffer)
+        self.buffer = generate(self.rng, self.CHUNK * self.n_tiles, self.mode, self.n_tiles)
+        self.position = 0
+
+    # returns the next count tiles as an array of bytes, fewer at the end of a replayed sequence
+    def take(self, count):
+        chunks = []
+        while count > 0:
+            if self.position == len(self.buffer):
+                if self.rng is None:
+                    break
+                self.refill()
+            chunk = self.buffer[self.position:self.position + count]
+            self.position += len(chunk)
+            count -= len(chunk)
+            chunks.append(chunk)
+        return numpy.frombuffer(b''.join(chunks), dtype=numpy.uint8)
+
+    # returns the tiles left in the bag of the last tile drawn, none in uniform mode
+    # the chunks hold whole bags, so that the bags never straddle two buffers
+    def bag(self):
+        if self.mode != 'bag':
+            return []
+        end = -(-self.position // self.n_tiles) * self.n_tiles
+        return list(self.buffer[self.position:end])
+
+
+# returns count tiles drawn with the NumPy generator rng, as bytes
+# in bag mode, count is a multiple of n_tiles
+def generate(rng, count, mode='bag', n_tiles=7):
+    if mode == 'bag':
+        bags = numpy.tile(numpy.arange(n_tiles, dtype=numpy.uint8), (count // n_tiles, 1))
+        return rng.permuted(bags, axis=1).tobytes()
+    return rng.integers(0, n_tiles, count, dtype=numpy.uint8).tobytes()
+
+
+# returns the first count tiles of the games seeded seed, seed + 1, ..., as a (games x count)
+# array of bytes
+def sequences(seed, games, count, mode='bag', n_tiles=7):
+    return numpy.stack([Pieces(seed + i, mode, n_tiles).take(count) for i in range(games)])
+
+
+# Sequence files hold the piece sequences of games : a header (magic, version, mode, number of
+# tiles, number of games) then for every game its seed and its number of tiles, followed by
+# its tiles, one byte each. The seed is -1 when it is unknown.
+MAGIC = b'TPCS'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBI')
+GAME = struct.Struct('<qI')
+
+
+# writes the sequences (bytes or arrays of bytes) to path, with the seeds of the games if known
+def save(path, sequences, mode='bag', n_tiles=7, seeds=None):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, MODES.index(mode), n_tiles, len(sequences)))
+        for i, sequence in enumerate(sequences):
+            sequence = bytes(sequence)
+            f.write(GAME.pack(-1 if seeds is None else seeds[i], len(sequence)))
+            f.write(sequence)
+
+
+# returns the streams replaying the sequences stored in path
+def load(path):
+    with open(path, 'rb') as f:
+        magic, version, mode, n_tiles, games = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a piece sequence file" % path)
+        streams = []
+        for i in range(games):
+            seed, count = GAME.unpack(f.read(GAME.size))
+            sequence = f.read(count)
+            if len(sequence) != count:
+                raise ValueError("%s is truncated" % path)
+            streams.append(Pieces(seed, MODES[mode], n_tiles, sequence))
+        return streams
@@ -0,0 +1,91 @@
+import random
+
+import Search
+
+
+# Policies choose the move played in a state. A policy is a function (state, agent)
+# returning one of state.moves, or None when there is none, where agent holds the
+# parameters of the policies : the weights w, the exploration rate epsilon, the
+# value-iteration table, the look-ahead search, the tiles left in the 7-bag after the
+# tile of the state and the generator of the random moves (a random.Random).
+POLICIES = {}
+
+# policies playing with the weights w of the agent
+WEIGHTED = ['vf', 'egreedy', 'search']
+
+# names of the policies of the integer options of Tetris.play
+OPTIONS = ['mdp', 'vf', 'random', 'lowest', 'holes', 'search']
+
+
+# registers the decorated policy under name
+def register(name):
+    def decorator(policy):
+        POLICIES[name] = policy
+        return policy
+    return decorator
+
+
+# returns the name of a policy given by its name or by its integer option of Tetris.play
+def resolve(policy):
+    if isinstance(policy, int):
+        return OPTIONS[policy]
+    return policy
+
+
+# returns the policy registered under name, or under the integer option of Tetris.play
+def get(name):
+    name = resolve(name)
+    if name not in POLICIES:
+        raise ValueError("unknown policy %s, expected one of %s" % (name, ', '.join(POLICIES)))
+    return POLICIES[name]
+
+
+# parameters of the policies when there is no Tetris game at hand
+class Agent:
+
+    def __init__(self, w=None, epsilon=0, table=None, search=None, bag=None, rng=None):
+        self.w = w
+        self.epsilon = epsilon
+        self.table = table
+        self.search = Search.Search() if search is None else search
+        self.bag = bag
+        self.rng = random.Random() if rng is None else rng
+
+
+# value-iteration policy (run Tetris.optimize() before)
+@register('mdp')
+def mdp(state, agent):
+    return agent.table.move(state.field, state.tile)
+
+
+# value-function approximation policy
+@register('vf')
+def vf(state, agent):
+    return state.vf_move(agent.w)
+
+
+# value-function approximation policy exploring with probability epsilon
+@register('egreedy')
+def egreedy(state, agent):
+    return state.vf_train_move(agent.w, agent.epsilon, agent.rng)
+
+
+# value-function approximation policy looking ahead at the next tiles of the bag
+@register('search')
+def search(state, agent):
+    return agent.search.move(state, agent.w, agent.bag)
+
+
+@register('random')
+def random_move(state, agent):
+    return state.random_move(agent.rng)
+
+
+@register('lowest')
+def lowest(state, agent):
+    return state.lowest_move()
+
+
+@register('holes')
+def holes(state, agent):
+    return state.hole_move()
@@ -0,0 +1,293 @@
+import argparse
+import struct
+import time
+
+import Pieces
+
+
+# Replay files record whole games in a compact binary form : a header (magic, version, board
+# size, piece mode, number of tiles and checkpoint interval) then the games one after the
+# other, so that they can be written and read as a stream. A game is its seed and a label
+# (the policy), one byte per move, an end byte and a footer with its score, pieces and lines,
+# whether it ended because a tile could not be placed and, when the tiles do not follow from
+# the seed (cfr. Pieces.Pieces), the tiles drawn.
+# A move byte holds the rotation (2 bits) and the column (6 bits) of the tile, the row is the
+# one of the position of that rotation and column (cfr. Field.positions).
+# With a checkpoint interval k, the score and the rows of the board are written after every
+# k moves, to check the re-simulations and find where they diverge.
+MAGIC = b'TRPL'
+VERSION = 1
+HEADER = struct.Struct('<4sBHHBBI')
+GAME = struct.Struct('<qB')
+CHECKPOINT = struct.Struct('<q')
+FOOTER = struct.Struct('<qIIBI')
+END = 0xFF
+SEGMENT = 4096
+
+
+# returns the byte of a move (i, j, rot)
+def encode(move):
+    return move[2] << 6 | move[1]
+
+
+# returns the rotation and the column of a move byte
+def decode(code):
+    return code >> 6, code & 63
+
+
+# returns the rows of a board as bytes, row_bytes bytes per row
+def pack_rows(rows, row_bytes):
+    return b''.join(row.to_bytes(row_bytes, 'little') for row in rows)
+
+
+def unpack_rows(data, row_bytes):
+    return [int.from_bytes(data[k:k + row_bytes], 'little') for k in range(0, len(data), row_bytes)]
+
+
+# Recording of one game of a m-column board, encoded while it is played.
+# The tiles are kept when tiles is True or the seed is None, for the games whose tiles do not
+# follow from their seed.
+class Recorder:
+
+    def __init__(self, m, seed=None, label='', checkpoint=0, tiles=False):
+        label = label.encode()
+        self.row_bytes = (m + 7) // 8
+        self.checkpoint = checkpoint
+        self.tiles = bytearray() if tiles or seed is None else None
+        self.moves = 0
+        self.data = bytearray(GAME.pack(-1 if seed is None else seed, len(label)))
+        self.data += label
+
+    # records the move of the tile, the field and score being those after the move
+    def move(self, tile, move, field, score):
+        self.data.append(encode(move))
+        self.moves += 1
+        if self.tiles is not None:
+            self.tiles.append(tile)
+        if self.checkpoint and self.moves % self.checkpoint == 0:
+            self.data += CHECKPOINT.pack(score)
+            self.data += pack_rows(field.row_masks(), self.row_bytes)
+
+    # ends the game and returns its record, tile being the tile which could not be placed when
+    # the game is over
+    def finish(self, score, pieces, lines, tile=None):
+        tiles = self.tiles
+        if tiles is not None and tile is not None:
+            tiles = tiles + bytes([tile])
+        self.data.append(END)
+        self.data += FOOTER.pack(score, pieces, lines, tile is not None, 0 if tiles is None else len(tiles))
+        if tiles is not None:
+            self.data += tiles
+        return bytes(self.data)
+
+
+# Streaming writer of a replay file for a n x m board, the games are written when they end.
+# The piece mode and number of tiles are those of Tetris by default.
+class Writer:
+
+    def __init__(self, path, n, m, checkpoint=0, mode=None, n_tiles=None):
+        import Tetris
+        if m > 63:
+            raise ValueError("replays hold boards of at most 63 columns, not %d" % m)
+        self.n = n
+        self.m = m
+        self.checkpoint = checkpoint
+        self.games = 0
+        mode = Tetris.Tetris.PIECES if mode is None else mode
+        n_tiles = len(Tetris.Tetris.TILES) if n_tiles is None else n_tiles
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, n, m, Pieces.MODES.index(mode), n_tiles, checkpoint))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # starts the recording of a game, cfr. Recorder
+    def record(self, seed=None, label='', tiles=False):
+        return Recorder(self.m, seed, label, self.checkpoint, tiles)
+
+    # writes the record of a game (cfr. Recorder.finish)
+    def write(self, game):
+        self.file.write(game)
+        self.games += 1
+
+    def close(self):
+        self.file.close()
+
+
+# Game read from a replay file : its moves (bytes), checkpoints (score and rows after every
+# checkpoint moves) and recorded results.
+class Replay:
+
+    def __init__(self, n, m, mode, n_tiles, checkpoint, seed, label, moves, checkpoints, score, pieces, lines,
+                 over, sequence):
+        self.n = n
+        self.m = m
+        self.mode = mode
+        self.n_tiles = n_tiles
+        self.checkpoint = checkpoint
+        self.seed = seed
+        self.label = label
+        self.moves = moves
+        self.checkpoints = checkpoints
+        self.score = score
+        self.pieces = pieces
+        self.lines = lines
+        self.over = over
+        self.sequence = sequence
+
+    # returns the stream of the tiles of the game
+    def tiles(self):
+        return Pieces.Pieces(self.seed, self.mode, self.n_tiles, self.sequence)
+
+    # returns the recorded results, as those of Evaluation.play_games
+    def result(self):
+        return {'policy': self.label, 'seed': self.seed, 'score': self.score, 'pieces': self.pieces,
+                'lines': self.lines}
+
+
+# Streaming reader of a replay file, iterating over its games (Replay).
+class Reader:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        header = self.file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise ValueError("%s is not a replay file" % path)
+        magic, version, self.n, self.m, mode, self.n_tiles, self.checkpoint = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a replay file" % path)
+        self.mode = Pieces.MODES[mode]
+        self.row_bytes = (self.m + 7) // 8
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        f = self.file
+        data = f.read(GAME.size)
+        if len(data) == 0:
+            raise StopIteration
+        seed, length = GAME.unpack(self.read(GAME.size, data))
+        label = self.read(length).decode()
+
+        # the moves are read by segments of checkpoint moves, each followed by its checkpoint,
+        # until the end byte
+        moves = []
+        checkpoints = []
+        size = self.checkpoint or SEGMENT
+        while True:
+            segment = f.read(size)
+            end = segment.find(END)
+            if end >= 0:
+                moves.append(segment[:end])
+                f.seek(end + 1 - len(segment), 1)
+                break
+            if len(segment) < size:
+                raise ValueError("%s is truncated" % self.path)
+            moves.append(segment)
+            if self.checkpoint:
+                score, = CHECKPOINT.unpack(self.read(CHECKPOINT.size))
+                checkpoints.append((score, unpack_rows(self.read(self.n * self.row_bytes), self.row_bytes)))
+
+        score, pieces, lines, over, count = FOOTER.unpack(self.read(FOOTER.size))
+        sequence = self.read(count) if count > 0 else None
+        return Replay(self.n, self.m, self.mode, self.n_tiles, self.checkpoint, seed, label, b''.join(moves),
+                      checkpoints, score, pieces, lines, bool(over), sequence)
+
+    # reads size bytes, following the bytes already read
+    def read(self, size, data=b''):
+        data += self.file.read(size - len(data))
+        if len(data) != size:
+            raise ValueError("%s is truncated" % self.path)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+# returns the games of a replay file
+def load(path):
+    with Reader(path) as reader:
+        return list(reader)
+
+
+# re-simulates a replay through Field.successor, yielding the tile, the move, the field and
+# the score after every move
+# the moves must be positions of the fields (cfr. Field.positions) and the boards those of the
+# checkpoints, as well as the scores when strict (the scores change with Tetris.ROW_GAIN),
+# a ValueError is raised otherwise
+def steps(replay, strict=True):
+    import Tetris
+    field = Tetris.Tetris.FIELD(replay.n, replay.m)
+    tiles = replay.tiles()
+    score = 0
+    for k, code in enumerate(replay.moves):
+        tile = next(tiles, None)
+        if tile is None:
+            raise ValueError("the tiles of the replay end after %d moves" % k)
+        rot, j = decode(code)
+        move = None
+        for position in field.positions(Tetris.Tetris.TILES[tile]):
+            if position[1] == j and position[2] == rot:
+                move = position
+                break
+        if move is None:
+            raise ValueError("move %d (rotation %d, column %d) of the replay cannot place tile %d" % (k, rot, j, tile))
+
+        field, gain, true_gain = field.successor(Tetris.Tetris.TILES[tile], move)
+        score += true_gain
+        if replay.checkpoint and (k + 1) % replay.checkpoint == 0:
+            checkpoint_score, rows = replay.checkpoints[(k + 1) // replay.checkpoint - 1]
+            if list(field.row_masks()) != rows:
+                raise ValueError("the board after move %d differs from the checkpoint of the replay" % k)
+            if strict and score != checkpoint_score:
+                raise ValueError("the score after move %d is %d, the replay has %d" % (k, score, checkpoint_score))
+        yield tile, move, field, score
+
+    if replay.over:
+        tile = next(tiles, None)
+        if tile is None or len(field.positions(Tetris.Tetris.TILES[tile])) > 0:
+            raise ValueError("the replay ends with a game over, but the next tile can be placed")
+
+
+# re-simulates a replay (cfr. steps) and returns its results, as those of Evaluation.play_games
+# when strict, they must be the recorded ones
+def simulate(replay, strict=True):
+    start = time.time()
+    score = 0
+    pieces = 0
+    lines = 0
+    for tile, move, field, score in steps(replay, strict):
+        pieces += 1
+        lines += field.cleared
+
+    if strict and (score, pieces, lines) != (replay.score, replay.pieces, replay.lines):
+        raise ValueError("the replay scores %d with %d pieces and %d lines, it records %d with %d pieces and %d lines" %
+                         (score, pieces, lines, replay.score, replay.pieces, replay.lines))
+    return {'policy': replay.label, 'seed': replay.seed, 'score': score, 'pieces': pieces, 'lines': lines,
+            'time': time.time() - start}
+
+
+if __name__ == '__main__':
+    import Evaluation
+    parser = argparse.ArgumentParser(description='Re-simulates and checks the games of a replay file')
+    parser.add_argument('path')
+    parser.add_argument('--rescore', action='store_true', help='only check the moves and boards, not the scores')
+    args = parser.parse_args()
+
+    results = {}
+    with Reader(args.path) as reader:
+        for replay in reader:
+            result = simulate(replay, not args.rescore)
+            results.setdefault(result['policy'], []).append(result)
+    Evaluation.report(Evaluation.summarize(results))
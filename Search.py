@@ -0,0 +1,116 @@
+import time
+
+import numpy
+
+import Cache
+import State
+
+
+# raised when the time budget of a move is spent
+class Timeout(Exception):
+    pass
+
+
+# Depth-limited expectimax search over the moves of the next tiles.
+# The tiles are drawn from a 7-bag : the next tile is uniform over the tiles left in the
+# bag (a new bag when it is empty or unknown). The leaves are valued by the linear value
+# function, and only the beam best moves of a state by the value function are searched
+# deeper. The depths are searched in increasing order until the time budget of the move
+# is spent, the move of the deepest completed search is played.
+# The states (field, tile) are kept in a transposition table on the board key, so that the
+# moves, successors and features computed at a depth are reused by the deeper searches,
+# and the expected values of (board, bag, depth) are memoized. Both are bounded LRU caches
+# (cfr. Cache.Cache) : a state holds its successors and features (about 20 KB), so that the
+# table keeps capacity states only. They are not pickled with the search.
+class Search:
+
+    LOSS = -1000000
+
+    def __init__(self, budget=0.005, beam=4, max_depth=3, capacity=2000, expectations=100000):
+        self.budget = budget
+        self.beam = beam
+        self.max_depth = max_depth
+        self.capacity = capacity
+        self.expectation_capacity = expectations
+        self.states = Cache.Cache(capacity)
+        self.expectations = Cache.Cache(expectations)
+        self.w = None
+        self.depth = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['states'], state['expectations']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.states = Cache.Cache(self.capacity)
+        self.expectations = Cache.Cache(self.expectation_capacity)
+
+    # returns the state of the tile on the field from the transposition table
+    def state(self, field, tile):
+        self.check()
+        key = (field.key(), tile)
+        state = self.states.get(key)
+        if state is None:
+            state = State.State(field, tile)
+            self.states.put(key, state)
+        return state
+
+    def check(self):
+        if time.perf_counter() > self.deadline:
+            raise Timeout()
+
+    # returns the value of the best move of the state searched to depth and its index
+    def best(self, state, bag, depth):
+        if len(state.moves) == 0:
+            return self.LOSS, None
+
+        values = state.values(self.w)
+        if depth == 0:
+            i = int(numpy.argmax(values))
+            return values[i], i
+
+        best = None
+        for i in numpy.argsort(-values, kind='stable')[:self.beam]:
+            value = state.gains[i] + self.expectation(state.next_fields[i], bag, depth - 1)
+            if best is None or value > best[0]:
+                best = (value, int(i))
+        return best
+
+    # returns the expected value of the field before drawing a tile from the bag
+    def expectation(self, field, bag, depth):
+        key = (field.key(), bag, depth)
+        value = self.expectations.get(key)
+        if value is None:
+            import Tetris
+            tiles = bag or tuple(range(len(Tetris.Tetris.TILES)))
+            value = sum(self.best(self.state(field, tile), tuple(t for t in tiles if t != tile), depth)[0]
+                        for tile in tiles) / len(tiles)
+            self.expectations.put(key, value)
+        return value
+
+    # returns the move of the search for the state, bag holding the tiles left in the bag
+    # after state.tile (None when unknown)
+    def move(self, state, w, bag=None):
+        if len(state.moves) == 0:
+            return None
+
+        if w is not self.w:
+            self.w = w
+            self.expectations.clear()
+
+        self.states.put((state.field.key(), state.tile), state)
+        bag = tuple(sorted(bag)) if bag else ()
+        self.deadline = float('inf')
+        move = state.moves[self.best(state, bag, 0)[1]]
+
+        self.depth = 0
+        self.deadline = time.perf_counter() + self.budget
+        try:
+            for depth in range(1, self.max_depth + 1):
+                move = state.moves[self.best(state, bag, depth)[1]]
+                self.depth = depth
+        except Timeout:
+            pass
+        return move
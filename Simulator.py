@@ -0,0 +1,279 @@
+import time
+
+import numpy
+
+import Features
+import Pieces
+
+
+# Candidate placements of every tile, padded to the same number of candidates.
+# Candidate c of tile t puts the distinct rotation rot[t, c], of height[t, c] rows, at column
+# j[t, c]; its column l is cols[l, t, c], with bottom and top filled rows bottoms[l, t, c] and
+# tops[l, t, c], and its row k is masks[k, t, c] once shifted to its column, with cells[k, t, c]
+# cells. Unused columns repeat the first one and unused rows have an empty mask.
+class Placements:
+
+    def __init__(self, tiles, m):
+        candidates = [[(rot, j) for rot in tile.distinct for j in range(m - tile.rotation(rot).m + 1)]
+                      for tile in tiles]
+        self.size = max(len(c) for c in candidates)
+
+        self.count = numpy.array([len(c) for c in candidates])
+        self.rot = numpy.zeros((len(tiles), self.size), dtype=numpy.int64)
+        self.j = numpy.zeros((len(tiles), self.size), dtype=numpy.int64)
+        self.height = numpy.ones((len(tiles), self.size), dtype=numpy.int64)
+        self.cols = numpy.zeros((4, len(tiles), self.size), dtype=numpy.int64)
+        self.bottoms = numpy.zeros((4, len(tiles), self.size), dtype=numpy.int64)
+        self.tops = numpy.zeros((4, len(tiles), self.size), dtype=numpy.int64)
+        self.masks = numpy.zeros((4, len(tiles), self.size), dtype=numpy.int32 if m < 32 else numpy.int64)
+        self.cells = numpy.zeros((4, len(tiles), self.size), dtype=numpy.int64)
+        self.sizes = numpy.array([tile.size for tile in tiles])
+
+        for t, tile in enumerate(tiles):
+            for c, (rot, j) in enumerate(candidates[t]):
+                shape = tile.rotation(rot)
+                self.rot[t, c] = rot
+                self.j[t, c] = j
+                self.height[t, c] = shape.n
+                for l in range(4):
+                    col = l if l < shape.m else 0
+                    self.cols[l, t, c] = j + col
+                    self.bottoms[l, t, c] = shape.bottoms[col]
+                    self.tops[l, t, c] = shape.tops[col]
+                for k in range(shape.n):
+                    self.masks[k, t, c] = shape.masks[k] << j
+                    self.cells[k, t, c] = shape.masks[k].bit_count()
+
+        self.shape = numpy.arange(self.size)[None, :] < self.count[:, None]
+
+
+# Headless game engine advancing many boards in lockstep.
+# The boards are stacked in an array (games x rows) of row bitmasks, the tiles are placed by
+# dropping them in their column (the shifts under overhangs of Field.positions are not
+# simulated). At every step the candidates of all the boards are generated at once, and a
+# policy callback receiving the simulator returns the candidate played on each board.
+# Game i plays the tiles of the seed seed + i (cfr. Pieces.Pieces), as the game of that seed
+# of Evaluation.play_games. With streams, only that many sequences are drawn and game i plays
+# the sequence i % streams, to compare policies on the same pieces in one batch.
+# The candidates are valued with the feature set (cfr. Features.get), by default the one of
+# the fields.
+class Simulator:
+
+    BAGS = 64
+
+    def __init__(self, n, m, games, seed=0, max_pieces=None, features=None, streams=None):
+        import Tetris
+        self.n = n
+        self.m = m
+        self.feature_set = Tetris.Tetris.FIELD.FEATURES if features is None else Features.get(features)
+        self.full = (1 << m) - 1
+        self.gain = 100 * Tetris.Tetris.ROW_GAIN ** 2
+        self.placements = Placements(Tetris.Tetris.TILES, m)
+        self.max_pieces = max_pieces
+        self.streams = games if streams is None else streams
+
+        self.rows = numpy.zeros((games, n), dtype=numpy.int32 if m < 32 else numpy.int64)
+        self.heights = numpy.zeros((games, m), dtype=numpy.int32)
+        self.cells = numpy.zeros(games, dtype=numpy.int64)
+        self.scores = numpy.zeros(games, dtype=numpy.int64)
+        self.pieces = numpy.zeros(games, dtype=numpy.int64)
+        self.lines = numpy.zeros(games, dtype=numpy.int64)
+        self.alive = numpy.ones(games, dtype=bool)
+
+        n_tiles = len(Tetris.Tetris.TILES)
+        self.generators = [Pieces.Pieces(seed + k, Tetris.Tetris.PIECES, n_tiles) for k in range(self.streams)]
+        self.sequences = numpy.zeros((games, 0), dtype=numpy.int64)
+
+    # returns the next tile of the given games, extending the piece sequences when needed
+    def draw(self, games):
+        if self.pieces[games].max() >= self.sequences.shape[1]:
+            count = self.BAGS * len(self.placements.count)
+            tiles = numpy.stack([generator.take(count) for generator in self.generators])
+            tiles = tiles[numpy.arange(len(self.alive)) % self.streams]
+            self.sequences = numpy.concatenate((self.sequences, tiles), axis=1)
+        return self.sequences[games, self.pieces[games]]
+
+    # generates the candidates of the boards of the games still alive
+    # sets active (games), tiles (their tiles), valid (candidates that fit), landing (top row
+    # of the tile), next_rows, next_cells, next_lines and next_eroded (boards after each
+    # candidate, games x candidates) and next_heights (columns x games x candidates)
+    def candidates(self):
+        p = self.placements
+        self.active = active = numpy.flatnonzero(self.alive)
+        self.tiles = tiles = self.draw(active)
+        games = len(active)
+        rows = self.rows[active]
+        heights = self.heights[active]
+        index = numpy.arange(games)[:, None]
+
+        cols = p.cols[:, tiles]
+        landing = None
+        for l in range(4):
+            top = self.n - heights[index, cols[l]] - p.bottoms[l][tiles]
+            landing = top if landing is None else numpy.minimum(landing, top)
+        landing -= 1
+        self.valid = p.shape[tiles] & (landing >= 0)
+        self.landing = landing = numpy.where(self.valid, landing, 0)
+
+        # place the tile, with 4 spare rows below the board for the empty rows of its mask
+        # only the rows of the tile can be full since the boards have no full row
+        next_rows = numpy.zeros((games, p.size, self.n + 4), dtype=self.rows.dtype)
+        next_rows[:, :, :self.n] = rows[:, None, :]
+        flat = next_rows.reshape(-1)
+        first = numpy.arange(0, games * p.size * (self.n + 4), self.n + 4).reshape(games, p.size) + landing
+        next_lines = numpy.zeros((games, p.size), dtype=numpy.int64)
+        for k in range(4):
+            row = first + k
+            flat[row] |= p.masks[k][tiles]
+            next_lines += flat[row] == self.full
+        next_rows = next_rows[:, :, :self.n]
+
+        next_heights = numpy.repeat(heights.T[:, :, None], p.size, axis=2)
+        flat = next_heights.reshape(-1)
+        cell = numpy.arange(games * p.size).reshape(games, p.size)
+        for l in range(4):
+            column = cols[l] * (games * p.size) + cell
+            flat[column] = numpy.maximum(flat[column], self.n - landing - p.tops[l][tiles])
+
+        # remove the full rows of the candidates clearing lines and recompute their heights
+        # the cells of the tile in the full rows are eroded
+        clearing = numpy.nonzero(next_lines > 0)
+        next_eroded = numpy.zeros((games, p.size), dtype=numpy.int64)
+        if len(clearing[0]) > 0:
+            cleared = next_rows[clearing]
+            candidate = (tiles[clearing[0]], clearing[1])
+            for k in range(4):
+                row = numpy.minimum(landing[clearing] + k, self.n - 1)
+                full = cleared[numpy.arange(len(row)), row] == self.full
+                next_eroded[clearing] += full * p.cells[k][candidate]
+            order = numpy.argsort(cleared != self.full, axis=1, kind='stable')
+            cleared = numpy.take_along_axis(cleared, order, axis=1)
+            cleared[numpy.arange(self.n)[None, :] < next_lines[clearing][:, None]] = 0
+            next_rows[clearing] = cleared
+
+            shadow = numpy.bitwise_or.accumulate(cleared, axis=1)
+            bits = (shadow[:, :, None] >> numpy.arange(self.m)) & 1
+            next_heights[:, clearing[0], clearing[1]] = bits.sum(axis=1).T
+
+        self.next_rows = next_rows
+        self.next_heights = next_heights
+        self.next_cells = self.cells[active][:, None] + p.sizes[tiles][:, None] - self.m * next_lines
+        self.next_lines = next_lines
+        self.next_eroded = next_lines * next_eroded
+
+    # returns the number of holes of the candidates
+    def holes(self):
+        return self.next_heights.sum(axis=0) - self.next_cells
+
+    # returns the feature vectors of the candidates (games x candidates x features), as Field.features
+    def features(self):
+        height = self.placements.height[self.tiles]
+        boards = Features.Boards(self.next_rows, self.m, self.next_heights.transpose(1, 2, 0), self.holes(),
+                                 self.n - self.landing - (height - 1) / 2, self.next_eroded)
+        return self.feature_set.extract_stack(boards)
+
+    # returns the value-function approximation of the candidates, cfr. State.values
+    def values(self, w):
+        features = self.features().transpose(2, 0, 1)
+        return numpy.tensordot(numpy.asarray(w, dtype=float), features, axes=1) + self.rewards()
+
+    # returns the rewards of the candidates, as Field.set_tile
+    def rewards(self):
+        heights = self.heights[self.active]
+        holes = heights.sum(axis=1) - self.cells[self.active]
+        averages = heights.sum(axis=1) / self.m
+        return (holes[:, None] - self.holes()) + 3 * (averages[:, None] - self.next_heights.sum(axis=0) / self.m)
+
+    # plays the candidate chosen by the policy on every active board, the games without
+    # valid candidate (or that reached max_pieces) end
+    def step(self, policy):
+        self.candidates()
+        active = self.active
+        playing = self.valid.any(axis=1)
+        choice = policy(self)
+
+        chosen = numpy.flatnonzero(playing)
+        games = active[chosen]
+        index = choice[chosen]
+        self.rows[games] = self.next_rows[chosen, index]
+        self.heights[games] = self.next_heights[:, chosen, index].T
+        self.cells[games] = self.next_cells[chosen, index]
+        lines = self.next_lines[chosen, index]
+        self.lines[games] += lines
+        self.scores[games] += self.gain * lines ** 2
+        self.pieces[games] += 1
+
+        self.alive[active[~playing]] = False
+        if self.max_pieces is not None:
+            self.alive &= self.pieces < self.max_pieces
+
+    # plays until every game ends and returns the results of the games, as Evaluation.play_game
+    # the time of a game is its share of the wall time of the batch
+    def run(self, policy):
+        start = time.time()
+        while self.alive.any():
+            self.step(policy)
+        elapsed = time.time() - start
+
+        return [{'seed': g, 'score': int(self.scores[g]), 'pieces': int(self.pieces[g]),
+                 'lines': int(self.lines[g]), 'time': elapsed / len(self.scores)} for g in range(len(self.scores))]
+
+
+# returns the index of the best valid candidate of every board for the scores
+def best(sim, scores):
+    return numpy.where(sim.valid, scores, -numpy.inf).argmax(axis=1)
+
+
+# policy of the value-function approximation with the weights w, cfr. State.vf_move
+def linear(w):
+    return lambda sim: best(sim, sim.values(w))
+
+
+# policy of the value-function approximation with the weights W[i] on the board of game i
+def linears(W):
+    W = numpy.asarray(W, dtype=float)
+    return lambda sim: best(sim, numpy.einsum('gcd,gd->gc', sim.features(), W[sim.active]) + sim.rewards())
+
+
+# policy choosing a random valid candidate, cfr. State.random_move
+def uniform(seed=0):
+    rng = numpy.random.default_rng(seed)
+    return lambda sim: best(sim, rng.random(sim.valid.shape))
+
+
+# policy choosing the lowest candidate, cfr. State.lowest_move
+def lowest():
+    return lambda sim: best(sim, sim.landing)
+
+
+# policy choosing the candidate with the fewest holes, cfr. State.hole_move
+def fewest_holes():
+    return lambda sim: best(sim, -sim.holes())
+
+
+# policies of Policies.POLICIES, built from the weights w
+POLICIES = {
+    'vf': lambda w, seed: linear(w),
+    'random': lambda w, seed: uniform(seed),
+    'lowest': lambda w, seed: lowest(),
+    'holes': lambda w, seed: fewest_holes(),
+}
+
+
+# returns the batched policy of the name of a policy of Policies, for the weights w and the seed
+def get(name, w=None, seed=0):
+    if name not in POLICIES:
+        raise ValueError("unknown policy %s, expected one of %s" % (name, ', '.join(POLICIES)))
+    return POLICIES[name](w, seed)
+
+
+# plays the same games with every policy in a batch, as Evaluation.evaluate
+def evaluate(n, m, policies, w=None, games=15, seed=0, max_pieces=None):
+    batched = {policy: get(policy, w, seed) for policy in policies}
+    results = {}
+    for policy in policies:
+        results[policy] = Simulator(n, m, games, seed, max_pieces).run(batched[policy])
+        for game in results[policy]:
+            game['policy'] = policy
+            game['seed'] += seed
+    return results
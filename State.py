@@ -1,77 +1,104 @@
+import numpy
 import random
 
 
+# The moves are generated when the state is created, the successor fields, gains and
+# features are only computed the first time they are accessed.
+# When CACHE is a Cache.Cache, the states of the uncolored boards are cached on (board size,
+# board key, tile) : a state already cached shares the moves, successors and features of the
+# cached one.
+# The states no longer hold the values of value iteration (expectation, decision) nor update
+# them (mdp_update, mdp_move) : those are the ones of the states of a ValueIteration.ValueTable
+# (cfr. ValueTable.sweep, expectation and move, or Tetris.update and mdp_move).
 class State:
 
-    def __init__(self, field, tile, states=None):
-        self.states = states
+    __slots__ = ('field', 'tile', 'moves', 'next_fields', 'gains', 'true_gains', 'matrix', 'cached')
+
+    CACHE = None
+
+    def __init__(self, field, tile):
         self.field = field
         self.tile = tile
-        self.expectation = 0.0
-        self.decision = -1
-        self.moves = []
+        self.matrix = None
+        self.cached = None
+
+        if self.CACHE is not None and getattr(field, 'color', None) is None:
+            key = (field.n, field.m, field.key(), tile)
+            self.cached = self.CACHE.get(key)
+            if self.cached is not None:
+                self.moves = self.cached.moves
+                return
+            self.CACHE.put(key, self)
+
+        import Tetris
+        self.moves = field.positions(Tetris.Tetris.TILES[tile])
+
+    # computes the successors on the first access to next_fields, gains or true_gains
+    def __getattr__(self, name):
+        if name in ('next_fields', 'gains', 'true_gains'):
+            self.expand()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    # computes the successor field and the gains of every move
+    def expand(self):
+        if self.cached is not None:
+            self.next_fields = self.cached.next_fields
+            self.gains = self.cached.gains
+            self.true_gains = self.cached.true_gains
+            return
+
+        import Tetris
         self.next_fields = []
         self.gains = []
         self.true_gains = []
-
-        import Tetris
-        for move in field.positions(Tetris.Tetris.TILES[tile]):
-            self.moves.append(move)
-            (successor, gain, true_gain) = field.successor(Tetris.Tetris.TILES[tile], move)
+        for move in self.moves:
+            (successor, gain, true_gain) = self.field.successor(Tetris.Tetris.TILES[self.tile], move)
             self.next_fields.append(successor)
             self.gains.append(gain)
             self.true_gains.append(true_gain)
 
-    # updates this state in the value-iteration algorithm
-    def mdp_update(self):
+    # returns the successor field, the gain and the game gain of one of the moves, reusing
+    # the successors when they are already computed
+    def successor(self, move):
         import Tetris
-        new_expectation = -1.0
-        p = 1.0 / len(Tetris.Tetris.TILES)
-
-        for i in range(0, len(self.moves)):
-            move_expectation = self.true_gains[i]
-
-            for next_tile in range(0, len(Tetris.Tetris.TILES)):
-                if (self.next_fields[i].representation(), next_tile) not in self.states:
-                    self.states[(self.next_fields[i].representation(), next_tile)] = State(self.next_fields[i],
-                                                                                           next_tile, self.states)
-                successor = self.states[(self.next_fields[i].representation(), next_tile)]
-                move_expectation += p * successor.expectation
-
-            if move_expectation > new_expectation:
-                new_expectation = move_expectation
-                self.decision = i
-
-        delta = abs(self.expectation - new_expectation)
-        self.expectation = new_expectation
-        return delta
-
-    # returns the best move according to the value-iteration policy
-    def mdp_move(self):
-        if self.decision == -1:
-            return None
-        return self.moves[self.decision]
+        source = self if self.cached is None else self.cached
+        try:
+            next_fields = object.__getattribute__(source, 'next_fields')
+        except AttributeError:
+            return self.field.successor(Tetris.Tetris.TILES[self.tile], move)
+
+        i = self.moves.index(move)
+        return next_fields[i], source.gains[i], source.true_gains[i]
+
+    # returns the feature matrix of the successors, one row per move
+    def features(self):
+        if self.matrix is None and self.cached is not None:
+            self.matrix = self.cached.features()
+        if self.matrix is None:
+            self.matrix = numpy.array([field.features() for field in self.next_fields], dtype=float)
+        return self.matrix
+
+    # returns the value-function approximation of every move, gains included
+    def values(self, w):
+        return self.features() @ numpy.asarray(w, dtype=float) + numpy.asarray(self.gains, dtype=float)
 
     def vf_move(self, w):
-        move = None
-        max_value = 0
-
-        for i in range(len(self.moves)):
-            if move is None or self.next_fields[i].utility(w)[0] + self.gains[i] > max_value:
-                max_value = self.next_fields[i].utility(w)[0] + self.gains[i]
-                move = self.moves[i]
+        if len(self.moves) == 0:
+            return None
 
-        return move
+        return self.moves[int(numpy.argmax(self.values(w)))]
 
-    # returns the best move according to the value-function approximation policy
-    def vf_train_move(self, w, epsilon):
+    # returns the best move according to the value-function approximation policy, or a random
+    # move drawn from rng (a random.Random, the random module by default) with probability epsilon
+    def vf_train_move(self, w, epsilon, rng=random):
         if len(self.moves) == 0:
             return None
 
-        if random.random() > epsilon:
+        if rng.random() > epsilon:
             return self.vf_move(w)
 
-        return self.moves[random.randint(0, len(self.moves)-1)]
+        return self.moves[rng.randint(0, len(self.moves)-1)]
 
     # returns the best move according to the lowest move policy
     def lowest_move(self):
@@ -87,36 +114,24 @@ class State:
 
         return self.moves[index]
 
-    # returns a random move
-    def random_move(self):
+    # returns a random move drawn from rng (a random.Random, the random module by default)
+    def random_move(self, rng=random):
         if len(self.moves) == 0:
             return None
 
-        return self.moves[random.randint(0, len(self.moves)-1)]
+        return self.moves[rng.randint(0, len(self.moves)-1)]
 
     # returns the move leading to the minimum number of holes
     def hole_move(self):
         if len(self.moves) == 0:
             return None
 
-        minholes = 100000
-        index = -1
-        for i in range(len(self.next_fields)):
-            n_holes = self.next_fields[i].n_inaccessibles()
-            if n_holes < minholes:
-                minholes = n_holes
-                index = i
-
-        return self.moves[index]
+        return self.moves[int(numpy.argmin([field.n_inaccessibles() for field in self.next_fields]))]
 
     def print(self):
         import Tetris
         Tetris.Tetris.TILES[self.tile].print()
-        print("Expected score : %f" % self.expectation)
         self.field.print()
-        if len(self.moves) > 0:
-            print("=>")
-            self.next_fields[self.decision].print()
-        else:
+        if len(self.moves) == 0:
             print("GAME OVER")
         print()
@@ -0,0 +1,172 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import zlib
+
+import ValueIteration
+
+
+# Solved value tables are stored as an open-addressing hash table of fixed-size records,
+# read through mmap so that a lookup only touches the pages of its records.
+# header : magic, version, n, m, number of tiles, symmetric, key bytes, capacity, count
+# record : used, tile, key of the board (little-endian), decision, expectation
+MAGIC = b'TTVT'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHBHQQ')
+
+
+# returns the record layout for keys of key_bytes bytes
+def record(key_bytes):
+    return struct.Struct('<BB%dsid' % key_bytes)
+
+
+# returns the slot of the state in a table of the given capacity (a power of 2)
+def slot(key, tile, capacity):
+    return zlib.crc32(key, tile) & (capacity - 1)
+
+
+# writes the solved states of the value table to path
+def write_table(path, table):
+    if isinstance(table, StoredTable):
+        if os.path.abspath(path) != os.path.abspath(table.path):
+            shutil.copyfile(table.path, path)
+        return
+    if table.decisions is None:
+        table.decide()
+
+    key_bytes = (table.n * table.m + 7) // 8
+    layout = record(key_bytes)
+    states = table.expanded * len(table.tiles)
+    capacity = 1
+    while capacity < 2 * states:
+        capacity *= 2
+
+    with open(path, 'wb+') as f:
+        f.truncate(HEADER.size + capacity * layout.size)
+        with mmap.mmap(f.fileno(), 0) as mm:
+            HEADER.pack_into(mm, 0, MAGIC, VERSION, table.n, table.m, len(table.tiles),
+                             table.symmetric, key_bytes, capacity, states)
+            for state in range(states):
+                board, tile = divmod(state, len(table.tiles))
+                key = table.keys[board].to_bytes(key_bytes, 'little')
+                i = slot(key, tile, capacity)
+                while mm[HEADER.size + i * layout.size] != 0:
+                    i = (i + 1) & (capacity - 1)
+                layout.pack_into(mm, HEADER.size + i * layout.size, 1, tile, key,
+                                 int(table.decisions[state]), float(table.values[state]))
+
+
+# Value table read from a file written by write_table, usable in place of a ValueTable to
+# play and print the stored policy. It is read-only : it cannot be explored nor solved again.
+# It is pickled as its path, the processes receiving it open the file again. The file is
+# closed by close, at the end of a with block or when the table is garbage collected.
+class StoredTable(ValueIteration.ValueTable):
+
+    def __init__(self, path):
+        import Tetris
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("%s is not a value table" % path)
+        if len(self.mm) < HEADER.size:
+            self.close()
+            raise ValueError("%s is not a value table" % path)
+
+        magic, version, self.n, self.m, tiles, symmetric, self.key_bytes, self.capacity, self.count = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a value table" % path)
+        if tiles != len(Tetris.Tetris.TILES):
+            self.close()
+            raise ValueError("%s was solved for %d tiles" % (path, tiles))
+
+        self.tiles = Tetris.Tetris.TILES
+        self.symmetric = bool(symmetric)
+        self.layout = record(self.key_bytes)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        if 'mm' in self.__dict__:
+            self.close()
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def read_only(self, *args, **kwargs):
+        raise ValueError("the value table of %s is read-only, solve a ValueTable instead" % self.path)
+
+    add = expand = explore = update = converge = decide = read_only
+
+    # returns the number of stored states
+    def size(self):
+        return self.count
+
+    # returns the record of the tile on the field, the field of the board and the tile on it
+    def state(self, field, tile):
+        key, tile, mirrored = self.canonical(field, tile)
+        if mirrored:
+            field = field.mirror()
+
+        key = key.to_bytes(self.key_bytes, 'little')
+        i = slot(key, tile, self.capacity)
+        while True:
+            used, stored_tile, stored_key, decision, expectation = \
+                self.layout.unpack_from(self.mm, HEADER.size + i * self.layout.size)
+            if not used:
+                raise KeyError((field.key(), tile))
+            if stored_tile == tile and stored_key == key:
+                return (decision, expectation), field, tile
+            i = (i + 1) & (self.capacity - 1)
+
+    # returns the expected score of the state
+    def expectation(self, field, tile):
+        return self.state(field, tile)[0][1]
+
+    # returns the best move according to the stored value-iteration policy
+    def move(self, field, tile):
+        (decision, expectation), board, board_tile = self.state(field, tile)
+        return self.decision_move(field, tile, board, board_tile, decision)
+
+    # prints the stored states, in the order of their records
+    def print(self):
+        for i in range(self.capacity):
+            used, tile, key, decision, expectation = \
+                self.layout.unpack_from(self.mm, HEADER.size + i * self.layout.size)
+            if used:
+                self.print_state(int.from_bytes(key, 'little'), tile, expectation, decision)
+
+
+# writes the weights learned for a n x m board and the feature set they apply to
+def save_weights(path, w, n, m, features='default'):
+    with open(path, 'w') as f:
+        json.dump({'n': n, 'm': m, 'features': features, 'dimension': len(w), 'w': list(w)}, f)
+
+
+# reads weights written by save_weights, checking that they were learned for the board
+def load_weights(path, n=None, m=None, features='default'):
+    with open(path) as f:
+        data = json.load(f)
+
+    if (n is not None and data['n'] != n) or (m is not None and data['m'] != m):
+        raise ValueError("%s holds weights for a %dx%d board" % (path, data['n'], data['m']))
+    if data['features'] != features or len(data['w']) != data['dimension']:
+        raise ValueError("%s holds weights for the feature set %s" % (path, data['features']))
+    return [float(x) for x in data['w']]
@@ -0,0 +1,91 @@
+# Streaming n-step TD returns of an episode.
+# The features of the last n+1 states and the rewards of the last n steps are kept in ring
+# buffers. The target of the state tau, with T the number of states of the episode, is
+#   G = sum of gamma^(i-tau-1) * r_i for tau < i < min(tau+n, T)
+#       + gamma^n * value(features of the state tau+n)   when tau+n < T
+# The reward sum of the oldest pending state is updated incrementally when the window
+# slides, so that adding a state costs O(1) whatever n. The update divides by gamma, which
+# multiplies the rounding errors by 1/gamma at every step : the sum is recomputed exactly
+# every n steps, which keeps the amortized cost O(1) and the errors bounded in long episodes.
+class TDBuffer:
+
+    def __init__(self, n, gamma, features):
+        self.n = n
+        self.gamma = gamma
+        self.discount = gamma ** n
+        self.last = gamma ** (n - 2) if n > 1 else 0
+        self.powers = [gamma ** i for i in range(n)]
+        self.features = [None for i in range(n + 1)]
+        self.rewards = [0 for i in range(n + 1)]
+        self.features[0] = features
+        self.t = 0
+        self.tau = 0
+        self.sum = 0
+
+    # adds the state t+1 reached with the reward
+    # returns the target (features, G) of the state t+1-n when it is complete, None otherwise
+    # value returns the value of a feature vector for the bootstrap
+    def push(self, features, reward, value):
+        self.t += 1
+        self.features[self.t % (self.n + 1)] = features
+        self.rewards[self.t % (self.n + 1)] = reward
+
+        if self.t - self.tau < self.n:
+            self.sum += reward * self.gamma ** (self.t - self.tau - 1)
+            return None
+
+        G = self.sum + self.discount * value(features)
+        return self.pop(G, reward)
+
+    # returns the targets of the pending states once the episode is over
+    def finish(self):
+        targets = []
+        while self.tau <= self.t:
+            targets.append(self.pop(self.sum, 0))
+        return targets
+
+    # returns the target of the oldest pending state and slides the window, adding the reward
+    # of the state tau+n
+    def pop(self, G, reward):
+        target = (self.features[self.tau % (self.n + 1)], G)
+        if self.n > 1:
+            self.sum = (self.sum - self.rewards[(self.tau + 1) % (self.n + 1)]) / self.gamma + reward * self.last
+        self.tau += 1
+        if self.tau % self.n == 0:
+            self.sum = self.window()
+        return target
+
+    # returns the exact reward sum of the oldest pending state
+    def window(self):
+        size = self.n + 1
+        return sum(self.rewards[i % size] * self.powers[i - self.tau - 1]
+                   for i in range(self.tau + 1, min(self.tau + self.n, self.t + 1)))
+
+
+# compares the targets of an episode of T random rewards with their direct sums, every stride
+# states, and returns the largest difference
+# the bootstrap values are 0 and the features are the indices of the states
+def check(n=20, gamma=0.99995, T=1000000, seed=0, stride=997):
+    import random
+    rng = random.Random(seed)
+    rewards = [0] + [rng.uniform(-1, 1) for t in range(T - 1)]
+    buffer = TDBuffer(n, gamma, 0)
+    targets = []
+    for t in range(1, T):
+        target = buffer.push(t, rewards[t], lambda features: 0)
+        if target is not None:
+            targets.append(target)
+    targets += buffer.finish()
+
+    error = 0
+    for tau, G in targets[::stride]:
+        direct = sum(rewards[i] * gamma ** (i - tau - 1) for i in range(tau + 1, min(tau + n, T)))
+        error = max(error, abs(G - direct))
+    return error
+
+
+if __name__ == '__main__':
+    error = check()
+    print("Largest difference with the direct sums : %g" % error)
+    if error > 1e-9:
+        raise SystemExit("the n-step returns drift from the direct sums")
@@ -1,9 +1,23 @@
-import Field
+import BitField
+import CrossEntropy
+import Evaluation
+import Learner
+import Metrics
+import Pieces
 import Tile
+import Policies
+import Replay
+import Search
+import Simulator
 import State
+import Storage
+import TDBuffer
+import Training
+import ValueIteration
 import random
 import time
 import math
+import os
 
 
 class Tetris:
@@ -21,85 +35,108 @@ class Tetris:
 
     ROW_GAIN = 1
 
+    # tile of the mirror image of each tile
+    MIRROR = [0, 2, 1, 3, 6, 5, 4]
+
+    # backend used for the game fields
+    FIELD = BitField.BitField
+
+    # whether a field and its mirror image share their states in the value-iteration table
+    SYMMETRIC = False
+
+    # how the tiles of the games are drawn, cfr. Pieces.MODES
+    PIECES = 'bag'
+
     def __init__(self, n, m):
         self.n = n
         self.m = m
-        self.states = {}
-
-        for i in range(0, len(Tetris.TILES)):
-            field = Field.Field(n, m)
-            self.states[(field.representation(), i)] = State.State(field, i, self.states)
-
-    # single pass of the value-iteration algorithm
+        self.table = ValueIteration.ValueTable(n, m)
+        self.search = Search.Search()
+        self.w = None
+
+    # returns the key of the state (field, tile) in the value-iteration table, the key of its
+    # board and the tile on it (cfr. ValueIteration.ValueTable.canonical)
+    def key(self, field, tile):
+        return self.table.canonical(field, tile)[:2]
+
+    # returns the id of the state (field, tile) in the value-iteration table
+    def state(self, field, tile):
+        return self.table.state(field, tile)[0]
+
+    # single pass of the value-iteration algorithm, the new boards are expanded first
+    # returns the total change of the expectations and whether new states were discovered
+    # optimize() explores first and converges faster, this pass is kept for the callers of the
+    # former solver
     def update(self):
-        states = list(self.states.values())
-        n_states = len(states)
+        n_states = self.table.size()
         print("New iteration with %d states" % n_states)
-        total_delta = 0
-        for state in states:
-            total_delta += state.mdp_update()
-        return total_delta, n_states != len(self.states)
+        self.table.expand()
+        return self.table.sweep(), n_states != self.table.size()
 
     # performs the value-iteration algorithm
-    def optimize(self):
-        growing = True
-        delta = 0
-        while growing or delta > 1e-6:
-            delta, growing = self.update()
-            print("Total delta of expectations : %f" % delta)
+    # the reachable states are discovered first, then their values are updated until convergence
+    # the sweeps are recorded in metrics when given (a Metrics.Metrics)
+    def optimize(self, metrics=None):
+        self.table.explore(metrics=metrics)
+        self.table.converge(metrics=metrics)
+        self.table.decide()
 
     # simulates one game and applies the n-step semi-gradient TD algorithm
-    def episode(self, w, alpha, epsilon):
+    # only the last n states are kept, cfr. TDBuffer
+    # the episode (and its steps at level Metrics.STEP) is recorded in metrics when given
+    # the tiles are those of the seed, of a seed drawn from random when it is None
+    def episode(self, w, alpha, epsilon, metrics=None, seed=None):
         score = 0
+        pieces = 0
+        lines = 0
+        start = time.time()
+        steps = metrics is not None and metrics.wants(Metrics.Metrics.STEP)
         T = 1000000
-        tau = 0
-        t = 0
         n = 20
         gamma = 0.99995
 
-        states = [Field.Field(self.n, self.m)]
-        rewards = [0]
-        tiles = []
+        field = self.FIELD(self.n, self.m)
+        buffer = TDBuffer.TDBuffer(n, gamma, field.features())
+        learner = Learner.Learner(w)
+        if seed is None:
+            seed = random.getrandbits(32)
+        tiles = Pieces.Pieces(seed, self.PIECES, len(self.TILES))
 
-        while tau < T:
-            if t < T:
-                if len(tiles) == 0:
-                    tiles = [i for i in range(len(self.TILES))]
-                tile = tiles[random.randint(0, len(tiles) - 1)]
-                tiles.remove(tile)
-                move = State.State(states[t], tile).vf_train_move(w, epsilon)
+        for t in range(T):
+            tile = next(tiles)
+            move = State.State(field, tile).vf_train_move(learner.w, epsilon)
 
-                if move is None:
-                    T = t + 1
-                    rewards.append(-1000000000)
-                    states.append(states[t])
-                else:
-                    (next_field, gain, game_gain) = states[t].successor(self.TILES[tile], move)
-
-                    states.append(next_field)
-                    rewards.append(gain)
-
-                    score += game_gain
-
-            tau = t - n + 1
+            if move is None:
+                break
 
-            if tau >= 0:
-                G = 0
-                for i in range(tau+1, min(tau+n, T)):
-                    G += rewards[i] * (gamma ** (i - tau - 1))
+            (field, gain, game_gain) = field.successor(self.TILES[tile], move)
+            score += game_gain
+            pieces += 1
+            lines += field.cleared
+            if steps:
+                metrics.log('step', Metrics.Metrics.STEP, piece=pieces, tile=tile, gain=gain, score=score,
+                            lines=field.cleared)
 
-                if tau + n < T:
-                    G += states[tau + n].utility(w)[0] * (gamma ** n)
+            target = buffer.push(field.features(), gain, learner.value)
+            if target is not None:
+                learner.update(target[0], target[1], alpha)
 
-                w = states[tau].utility_update(w, alpha, G)
+        # the states left in the buffer, then the end of the game valued 0
+        learner.apply(buffer.finish() + [(field.features(), 0)], alpha)
 
-            t += 1
+        if metrics is not None:
+            elapsed = time.time() - start
+            metrics.log('episode', score=score, pieces=pieces, lines=lines, epsilon=epsilon, alpha=alpha,
+                        norm=learner.norm(), pieces_per_s=pieces / max(elapsed, 1e-9))
 
-        return w, score
+        return learner.weights(), score
 
     # runs the value-function approximation algorithm
-    def learn(self):
-        w = [0 for i in range(Field.Field(self.n, self.m).dimension())]
+    # the episodes are recorded in metrics when given (a Metrics.Metrics)
+    # with seed, the episode k plays the tiles of the seed seed + k, otherwise the seeds of the
+    # episodes are drawn from random
+    def learn(self, metrics=None, seed=None):
+        w = [0 for i in range(self.FIELD(self.n, self.m).dimension())]
 
         n_episodes = 50
         mod = n_episodes / 10
@@ -110,7 +147,8 @@ class Tetris:
         max_score = -1000000
 
         for k in range(n_episodes+1):
-            w, score = self.episode(w, math.exp(-k), 1 / (1 + 16 * math.log(k+1)))
+            w, score = self.episode(w, math.exp(-k), 1 / (1 + 16 * math.log(k+1)), metrics,
+                                    None if seed is None else seed + k)
             scores.append(score)
             sum += score
             min_score = min(min_score, score)
@@ -125,140 +163,119 @@ class Tetris:
         print(w)
         self.w = w
 
-    # compares the performances of several approaches
-    def compare_perf(self):
-        tests = 15
-        #sum_mdp = 0
-        sum_vf = 0
-        sum_rnd = 0
-        sum_low = 0
-        sum_hol = 0
-
-        for i in range(tests):
-            #current_field_mdp = Field.Field(self.n, self.m)
-            current_field_vf = Field.Field(self.n, self.m)
-            current_field_rnd = Field.Field(self.n, self.m)
-            current_field_low = Field.Field(self.n, self.m)
-            current_field_hol = Field.Field(self.n, self.m)
-            #score_mdp = 0
-            score_vf = 0
-            score_rnd = 0
-            score_low = 0
-            score_hol = 0
-            #end_mdp = False
-            end_vf = False
-            end_rnd = False
-            end_hol = False
-            end_low = False
-
-            tiles = []
-
-            while not end_vf or not end_hol or not end_low or not end_rnd: # or not end_mdp
-                if len(tiles) == 0:
-                    tiles = [i for i in range(len(self.TILES))]
-                tile = tiles[random.randint(0, len(tiles) - 1)]
-                tiles.remove(tile)
-
-                # if not end_mdp:
-                #     move_mdp = self.states[(current_field_mdp.representation(), tile)].mdp_move()
-                #     if move_mdp is None:
-                #         end_mdp = True
-                #     else:
-                #         (current_field_mdp, my_gain, gain) = current_field_mdp.successor(self.TILES[tile], move_mdp)
-                #         score_mdp += gain
-
-                if not end_vf:
-                    move_vf = State.State(current_field_vf, tile).vf_move(self.w)
-                    if move_vf is None:
-                        end_vf = True
-                    else:
-                        (current_field_vf, my_gain, gain) = current_field_vf.successor(self.TILES[tile], move_vf)
-                        score_vf += gain
-
-                if not end_rnd:
-                    move_rnd = State.State(current_field_rnd, tile).random_move()
-                    if move_rnd is None:
-                        end_rnd = True
-                    else:
-                        (current_field_rnd, my_gain, gain) = current_field_rnd.successor(self.TILES[tile], move_rnd)
-                        score_rnd += gain
-
-                if not end_hol:
-                    move_hol = State.State(current_field_hol, tile).hole_move()
-                    if move_hol is None:
-                        end_hol = True
-                    else:
-                        (current_field_hol, my_gain, gain) = current_field_hol.successor(self.TILES[tile], move_hol)
-                        score_hol += gain
-
-                if not end_low:
-                    move_low = State.State(current_field_low, tile).lowest_move()
-                    if move_low is None:
-                        end_low = True
-                    else:
-                        (current_field_low, my_gain, gain) = current_field_low.successor(self.TILES[tile], move_low)
-                        score_low += gain
-
-            #sum_mdp += score_mdp
-            sum_vf += score_vf
-            sum_hol += score_hol
-            sum_rnd += score_rnd
-            sum_low += score_low
-
-            print(str(i+1) + " done")
-
-        return sum_vf/tests, sum_rnd/tests, sum_low/tests, sum_hol/tests  # , sum_mdp/tests
+    # runs the value-function approximation algorithm with parallel actors, cfr. Training.learn
+    def learn_parallel(self, n_episodes=50, actors=None, cadence=None, synchronous=True, seed=0, processes=None,
+                       metrics=None):
+        self.w = Training.learn(self.n, self.m, n_episodes, actors, cadence, synchronous, seed, processes,
+                                metrics=metrics)
+        print(self.w)
+
+    # searches the weights of the value-function approximation with the noisy cross-entropy
+    # method instead of TD learning, cfr. CrossEntropy.CrossEntropy for the parameters, the
+    # weights are the best vector sampled (cfr. CrossEntropy.weights)
+    # the generations are recorded in metrics when given (a Metrics.Metrics)
+    def learn_cross_entropy(self, generations=20, population=100, games=10, max_pieces=1000, budget=None, seed=0,
+                            processes=1, metrics=None):
+        search = CrossEntropy.CrossEntropy(self.n, self.m, population, games=games, max_pieces=max_pieces,
+                                           budget=budget, seed=seed, processes=processes)
+        self.w = search.run(generations, metrics)
+        print(self.w)
+
+    # compares the performances of several approaches, given by their names in Policies
+    # the games are spread over the processes and every approach plays the same tiles
+    # with simulated, the games are played in batches by the headless simulator
+    # the games and the summaries are recorded in metrics when given (a Metrics.Metrics)
+    # with replays, the games are also written to that replay file (cfr. Replay.Writer), unless simulated
+    def compare_perf(self, tests=15, seed=0, processes=None, simulated=False,
+                     policies=('vf', 'random', 'lowest', 'holes'), metrics=None, replays=None):
+        if simulated:
+            self.agent(policies)
+            results = Simulator.evaluate(self.n, self.m, policies, self.w, tests, seed)
+        else:
+            agent = self.agent(policies)
+            results = Evaluation.evaluate(self.n, self.m, policies, self.w, tests, seed, processes, agent,
+                                          replays=replays)
+        summary = Evaluation.summarize(results)
+        Evaluation.report(summary)
+        if metrics is not None:
+            Evaluation.record(metrics, results, summary)
+
+        return tuple(summary[policy]['mean'] for policy in policies)
+
+    # returns the parameters of the policies (cfr. Policies.Agent) of this game, checking that
+    # the weights are there when a policy plays with them
+    def agent(self, policies, epsilon=0):
+        names = [Policies.resolve(policy) for policy in policies]
+        if self.w is None and any(name in Policies.WEIGHTED for name in names):
+            raise ValueError("no weights to play with, run learn() or load_weights() before")
+        return Policies.Agent(self.w, epsilon, self.table if 'mdp' in names else None, self.search)
 
     # tests the performances of the value-function approximation algorithm
-    def test_vf(self, w):
-        tests = 25
-        sum_vf = 0
-
-        for i in range(tests):
-            current_field_vf = Field.Field(self.n, self.m)
-            score_vf = 0
-            end_vf = False
-
-            tiles = []
-
-            while not end_vf:
-                if len(tiles) == 0:
-                    tiles = [i for i in range(len(self.TILES))]
-                tile = tiles[random.randint(0, len(tiles) - 1)]
-                tiles.remove(tile)
-
-                if not end_vf:
-                    move_vf = State.State(current_field_vf, tile).vf_move(w)
-                    if move_vf is None:
-                        end_vf = True
-                    else:
-                        (current_field_vf, my_gain, gain) = current_field_vf.successor(self.TILES[tile], move_vf)
-                        score_vf += gain
-
-            sum_vf += score_vf
-            print(str(i+1) + " done")
-
-        return sum_vf / tests
-
-    # play the game with a specific algorithm
-    # opt :
+    def test_vf(self, w, tests=25, seed=0, processes=None, simulated=False, metrics=None):
+        if simulated:
+            results = Simulator.evaluate(self.n, self.m, ['vf'], w, tests, seed)
+        else:
+            results = Evaluation.evaluate(self.n, self.m, ['vf'], w, tests, seed, processes)
+        summary = Evaluation.summarize(results)
+        Evaluation.report(summary)
+        if metrics is not None:
+            Evaluation.record(metrics, results, summary)
+
+        return summary['vf']['mean']
+
+    # saves the value-iteration table (run optimize() before)
+    def save_table(self, path):
+        Storage.write_table(path, self.table)
+
+    # loads a value-iteration table saved with save_table, it is read from disk on demand
+    # the table it replaces is closed when it was loaded as well
+    def load_table(self, path):
+        table = Storage.StoredTable(path)
+        if (table.n, table.m) != (self.n, self.m):
+            table.close()
+            raise ValueError("%s holds a table for a %dx%d board" % (path, table.n, table.m))
+        if isinstance(self.table, Storage.StoredTable):
+            self.table.close()
+        self.table = table
+
+    # saves the weights of the value-function approximation (run learn() before)
+    def save_weights(self, path):
+        Storage.save_weights(path, self.w, self.n, self.m, self.FIELD.FEATURES.name)
+
+    # loads weights saved with save_weights, for the feature set of the fields
+    def load_weights(self, path):
+        self.w = Storage.load_weights(path, self.n, self.m, self.FIELD.FEATURES.name)
+
+    # returns the move of the value-iteration policy (run optimize() before)
+    def mdp_move(self, field, tile):
+        return self.table.move(field, tile)
+
+    # play the game with a specific algorithm, given by its name in Policies or by opt :
     #   0 value-iteration (run optimize() before)
     #   1 value-function approximation (run learn() before)
     #   2 random
     #   3 lowest move
     #   4 minimum number of holes
-    def play(self, opt=1):
-        current_field = Field.Field(self.n, self.m)
+    #   5 look-ahead search over the next tiles of the bag (run learn() before)
+    # the tiles are those of the seed, of a seed drawn from random when it is None
+    # with replay, the game is written to that replay file (cfr. Replay.Writer)
+    def play(self, opt=1, delay=2, seed=None, replay=None):
+        policy = Policies.get(opt)
+        agent = self.agent([opt])
+        current_field = self.FIELD(self.n, self.m, colored=True)
         score = 0
+        pieces = 0
+        lines = 0
         my_gain = 0
 
-        tiles = []
+        if seed is None:
+            seed = random.getrandbits(32)
+        tiles = Pieces.Pieces(seed, self.PIECES, len(self.TILES))
+        recorder = Replay.Recorder(self.m, seed, Policies.resolve(opt))
+        last = None
 
-        while True:
-            if len(tiles) == 0:
-                tiles = [i for i in range(len(self.TILES))]
-            tile = tiles[random.randint(0, len(tiles)-1)]
-            tiles.remove(tile)
+        for tile in tiles:
+            agent.bag = tiles.bag()
 
             print("Current score : %d" % score)
             print("Current board :")
@@ -266,37 +283,38 @@ class Tetris:
             print("Tile to place :")
             self.TILES[tile].print()
 
-            if opt == 0:
-                move = self.states[(current_field.representation(), tile)].mdp_move()
-            elif opt == 1:
-                move = State.State(current_field, tile).vf_move(self.w)
-            elif opt == 2:
-                move = State.State(current_field, tile).random_move()
-            elif opt == 3:
-                move = State.State(current_field, tile).lowest_move()
-            elif opt == 4:
-                move = State.State(current_field, tile).hole_move()
+            move = policy(State.State(current_field, tile), agent)
 
             if move is None:
                 print("Impossible to place the tile !")
+                last = tile
                 break
 
             (current_field, my_gain, gain) = current_field.successor(self.TILES[tile], move)
             score += gain
+            pieces += 1
+            lines += current_field.cleared
+            recorder.move(tile, move, current_field, score)
 
-            time.sleep(2)
+            time.sleep(delay)
 
         print("GAME OVER ! Score : %d" % score)
         current_field.print()
+        if replay is not None:
+            with Replay.Writer(replay, self.n, self.m) as writer:
+                writer.write(recorder.finish(score, pieces, lines, last))
 
     def print(self):
-        for state in self.states.values():
-            state.print()
+        self.table.print()
 
 
 if __name__ == '__main__':
     game = Tetris(20, 10)
-    game.learn()
+    if os.path.exists('weights.json'):
+        game.load_weights('weights.json')
+    else:
+        game.learn()
+        game.save_weights('weights.json')
 
     play = True
     while play:
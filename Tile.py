@@ -6,6 +6,11 @@ class Tile:
         self.m = len(array[0])
         self.rotations = []
         self.color = color
+        self.size = sum(map(sum, array))
+        self.masks = [sum(array[i][j] << j for j in range(self.m)) for i in range(self.n)]
+        # first and last filled row of every column
+        self.tops = [min(i for i in range(self.n) if array[i][j] == 1) for j in range(self.m)]
+        self.bottoms = [max(i for i in range(self.n) if array[i][j] == 1) for j in range(self.m)]
 
         if first:
             previous = self.rotate()
@@ -13,6 +18,12 @@ class Tile:
                 self.rotations.append(previous)
                 previous = previous.rotate()
 
+            # rotations giving a shape different from all the previous ones
+            self.distinct = []
+            for rot in range(0, 4):
+                if all(self.rotations[r].array != self.rotations[rot].array for r in self.distinct):
+                    self.distinct.append(rot)
+
     # 0 if the cell is empty, 1 otherwise
     def get(self, i, j):
         return self.array[i][j]
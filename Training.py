@@ -0,0 +1,159 @@
+import math
+import multiprocessing
+import queue
+import random
+import time
+
+import Evaluation
+import Learner
+import Pieces
+import Policies
+import State
+import TDBuffer
+
+
+# returns the learning rate and the exploration rate of episode k, as in Tetris.learn
+def schedule(k):
+    return math.exp(-k), 1 / (1 + 16 * math.log(k+1))
+
+
+# plays one episode with a snapshot of the weights and returns its n-step TD targets, its
+# score and the number of pieces, lines and seconds it took
+# the moves are chosen by the policy of that name in Policies
+# the targets are pairs (features of the state at time tau, discounted return G)
+def run_actor(n, m, w, epsilon, seed, policy='egreedy'):
+    import Tetris
+    T = 1000000
+    steps = 20
+    gamma = 0.99995
+
+    move_policy = Policies.get(policy)
+    agent = Policies.Agent(w, epsilon, rng=random.Random(seed))
+    tiles = Pieces.Pieces(seed, Tetris.Tetris.PIECES, len(Tetris.Tetris.TILES))
+    field = Tetris.Tetris.FIELD(n, m)
+    buffer = TDBuffer.TDBuffer(steps, gamma, field.features())
+    value = Learner.Learner(w).value
+    targets = []
+    score = 0
+    lines = 0
+    start = time.time()
+
+    while buffer.t < T - 1:
+        tile = next(tiles)
+        move = move_policy(State.State(field, tile), agent)
+        if move is None:
+            break
+
+        (field, gain, game_gain) = field.successor(Tetris.Tetris.TILES[tile], move)
+        target = buffer.push(field.features(), gain, value)
+        if target is not None:
+            targets.append(target)
+        score += game_gain
+        lines += field.cleared
+
+    targets += buffer.finish()
+    return targets, score, {'pieces': buffer.t, 'lines': lines, 'time': time.time() - start}
+
+
+# unpacks the arguments of an episode for the process pool
+def run_task(task):
+    return run_actor(*task)
+
+
+# applies the n-step semi-gradient TD update of every target to the learner
+# with minibatch, the targets are applied in minibatches of that size, cfr. Learner.update_batch
+def apply(learner, alpha, targets, minibatch=None):
+    if minibatch is None:
+        learner.apply(targets, alpha)
+        return
+
+    for first in range(0, len(targets), minibatch):
+        batch = targets[first:first + minibatch]
+        learner.update_batch([features for features, G in batch], [G for features, G in batch], alpha)
+
+
+# records the episode k in metrics (a Metrics.Metrics)
+def record(metrics, k, score, stats, learner):
+    alpha, epsilon = schedule(k)
+    metrics.log('episode', episode=k, score=score, pieces=stats['pieces'], lines=stats['lines'], epsilon=epsilon,
+                alpha=alpha, norm=learner.norm(), pieces_per_s=stats['pieces'] / max(stats['time'], 1e-9))
+
+
+# runs the value-function approximation algorithm with parallel actors
+# synchronous : the actors of a round share the same weights and their targets are applied
+#               in episode order, so the result does not depend on the number of processes
+# otherwise   : the targets are applied as soon as an episode ends, and the new weights are
+#               published to the next actors every cadence episodes
+# with cache, the states are cached in a Cache.Cache of that capacity in every process
+# with minibatch, the targets of an episode are applied in minibatches of that size
+# the episodes are recorded in metrics when given (a Metrics.Metrics)
+def learn(n, m, n_episodes=50, actors=None, cadence=None, synchronous=True, seed=0, processes=None,
+          policy='egreedy', cache=None, minibatch=None, metrics=None):
+    import Tetris
+    if actors is None:
+        actors = processes or multiprocessing.cpu_count()
+    if cadence is None:
+        cadence = actors
+    learner = Learner.Learner([0 for i in range(Tetris.Tetris.FIELD(n, m).dimension())])
+    progress = Progress(n_episodes)
+
+    with multiprocessing.Pool(processes, Evaluation.initialize, Evaluation.settings(cache)) as pool:
+        if synchronous:
+            for first in range(0, n_episodes+1, actors):
+                episodes = range(first, min(first + actors, n_episodes+1))
+                tasks = [(n, m, learner.weights(), schedule(k)[1], seed + k, policy) for k in episodes]
+                for k, (targets, score, stats) in zip(episodes, pool.map(run_task, tasks)):
+                    apply(learner, schedule(k)[0], targets, minibatch)
+                    progress.add(k, score)
+                    if metrics is not None:
+                        record(metrics, k, score, stats, learner)
+        else:
+            done = queue.Queue()
+            published = learner.weights()
+
+            def start(k):
+                pool.apply_async(run_task, ((n, m, published, schedule(k)[1], seed + k, policy),),
+                                 callback=lambda result: done.put((k, result)), error_callback=done.put)
+
+            started = min(actors, n_episodes+1)
+            for k in range(started):
+                start(k)
+
+            for finished in range(1, n_episodes+2):
+                result = done.get()
+                if isinstance(result, BaseException):
+                    raise result
+                k, (targets, score, stats) = result
+                apply(learner, schedule(k)[0], targets, minibatch)
+                progress.add(finished - 1, score)
+                if metrics is not None:
+                    record(metrics, k, score, stats, learner)
+
+                if finished % cadence == 0:
+                    published = learner.weights()
+                if started <= n_episodes:
+                    start(started)
+                    started += 1
+
+    return learner.weights()
+
+
+# prints the scores like Tetris.learn does
+class Progress:
+
+    def __init__(self, n_episodes):
+        self.mod = max(1, n_episodes // 10)
+        self.sum = 0
+        self.min_score = 1000000
+        self.max_score = -1000000
+
+    def add(self, k, score):
+        self.sum += score
+        self.min_score = min(self.min_score, score)
+        self.max_score = max(self.max_score, score)
+
+        if k % self.mod == 0:
+            print("Iteration %d  avg. score %f [%f, %f]" % (k, self.sum / self.mod, self.min_score, self.max_score))
+            self.sum = 0
+            self.min_score = 1000000
+            self.max_score = -1000000
@@ -0,0 +1,267 @@
+import array
+import numpy
+import time
+
+import BitField
+
+
+# Value-iteration table of the states (board, tile).
+# Every discovered board gets an integer id and the state (board, tile) the id
+# board * n_tiles + tile. The moves of the expanded states are stored in flat arrays:
+# the moves of state s are the entries offsets[s] to offsets[s+1] of successors (id of
+# the board reached by the move) and gains (game gain of the move). The boards are
+# expanded in id order so that the offsets are increasing.
+# With symmetric, a board and its mirror image share their id, the tiles of the
+# mirrored boards being swapped with Tetris.MIRROR.
+class ValueTable:
+
+    def __init__(self, n, m, symmetric=None):
+        import Tetris
+        self.n = n
+        self.m = m
+        self.tiles = Tetris.Tetris.TILES
+        self.symmetric = Tetris.Tetris.SYMMETRIC if symmetric is None else symmetric
+
+        self.keys = []
+        self.ids = {}
+        self.expanded = 0
+        self.offsets = array.array('q', [0])
+        self.successors = array.array('q')
+        self.gains = array.array('d')
+        self.arrays = None
+        self.values = numpy.zeros(0)
+        self.decisions = None
+
+        self.add(BitField.BitField(n, m))
+
+    # returns the number of discovered states
+    def size(self):
+        return len(self.keys) * len(self.tiles)
+
+    # returns the key of the board stored for the tile on the field, the tile on that board and
+    # whether the board is the mirror image of the field (cfr. BitField.canonical)
+    def canonical(self, field, tile=0):
+        if self.symmetric:
+            (key, tile), mirrored = field.canonical(tile)
+            return key, tile, mirrored
+        return field.key(), tile, False
+
+    # returns the id of the board of the field, registering it if it is new
+    def add(self, field):
+        key = self.canonical(field)[0]
+        board = self.ids.get(key)
+        if board is None:
+            board = len(self.keys)
+            self.ids[key] = board
+            self.keys.append(key)
+        return board
+
+    # stores the moves of the discovered boards that are not expanded yet, at most limit boards
+    def expand(self, limit=None):
+        boards = len(self.keys)
+        if limit is not None:
+            boards = min(boards, self.expanded + limit)
+        for board in range(self.expanded, boards):
+            field = BitField.BitField.from_key(self.n, self.m, self.keys[board])
+            for tile in self.tiles:
+                for move in field.positions(tile):
+                    (next_field, gain, true_gain) = field.successor(tile, move)
+                    self.successors.append(self.add(next_field))
+                    self.gains.append(true_gain)
+                self.offsets.append(len(self.successors))
+        self.expanded = boards
+        self.arrays = None
+
+    # returns the move arrays as numpy arrays
+    def numpy_arrays(self):
+        if self.arrays is None:
+            self.arrays = (numpy.array(self.offsets, dtype=numpy.int64),
+                           numpy.array(self.successors, dtype=numpy.int64),
+                           numpy.array(self.gains, dtype=float))
+        return self.arrays
+
+    # sizes the values to the discovered states, the new states have the value 0
+    def resize(self):
+        if len(self.values) < self.size():
+            self.values = numpy.concatenate((self.values, numpy.zeros(self.size() - len(self.values))))
+
+    # returns the expected score of every move of the expanded states
+    def move_values(self):
+        self.resize()
+        offsets, successors, gains = self.numpy_arrays()
+        expectations = self.values.reshape(-1, len(self.tiles)).mean(axis=1)
+        return gains + expectations[successors]
+
+    # returns the best move value of every expanded state, -1 for the states without move
+    def maxima(self, q):
+        offsets = self.numpy_arrays()[0]
+        nonempty = offsets[1:] > offsets[:-1]
+
+        expectations = numpy.full(self.expanded * len(self.tiles), -1.0)
+        if len(q) > 0:
+            expectations[nonempty] = numpy.maximum.reduceat(q, offsets[:-1][nonempty])
+        return expectations
+
+    # computes the index of the best move of every expanded state, -1 if there is none
+    def decide(self):
+        offsets = self.numpy_arrays()[0]
+        states = self.expanded * len(self.tiles)
+        q = self.move_values()
+        counts = offsets[1:] - offsets[:-1]
+
+        best = numpy.flatnonzero(q == numpy.repeat(self.maxima(q), counts))
+        owners = numpy.searchsorted(offsets, best, side='right') - 1
+        owners, first = numpy.unique(owners, return_index=True)
+
+        self.decisions = numpy.full(states, -1, dtype=numpy.int64)
+        self.decisions[owners] = best[first] - offsets[owners]
+
+    # discovers every reachable board breadth-first from the empty board
+    # the boards not expanded yet form the frontier, they are expanded in id order
+    # the progress is printed at most every interval seconds, and every chunk is recorded
+    # in metrics when given (a Metrics.Metrics)
+    def explore(self, chunk=10000, verbose=True, interval=1.0, metrics=None):
+        start = time.time()
+        last = start
+        while self.expanded < len(self.keys):
+            chunk_start = time.time()
+            self.expand(chunk)
+            if metrics is not None:
+                metrics.log('explore', states=self.expanded * len(self.tiles),
+                            frontier=len(self.keys) - self.expanded, time=time.time() - chunk_start)
+            if verbose and (time.time() - last >= interval or self.expanded == len(self.keys)):
+                last = time.time()
+                elapsed = max(time.time() - start, 1e-9)
+                print("Explored %d states, frontier of %d boards, %.0f states/s" %
+                      (self.expanded * len(self.tiles), len(self.keys) - self.expanded,
+                       self.expanded * len(self.tiles) / elapsed))
+
+    # updates the values of the given expanded states in place
+    def update(self, states):
+        offsets, successors, gains = self.numpy_arrays()
+        counts = offsets[states + 1] - offsets[states]
+        states = states[counts > 0]
+        counts = counts[counts > 0]
+        if len(states) == 0:
+            return
+
+        ends = numpy.cumsum(counts)
+        moves = numpy.repeat(offsets[states] - ends + counts, counts) + numpy.arange(ends[-1])
+        q = gains[moves] + self.board_values[successors[moves]]
+        expectations = numpy.maximum.reduceat(q, ends - counts)
+
+        numpy.add.at(self.board_values, states // len(self.tiles),
+                     (expectations - self.values[states]) / len(self.tiles))
+        self.values[states] = expectations
+
+    # sizes the values to the discovered states, sets the value of the expanded states without
+    # move to -1 and computes the values of the boards (mean over the tiles) used by update
+    def prepare(self):
+        self.resize()
+        offsets = self.numpy_arrays()[0]
+        self.values[:self.expanded * len(self.tiles)][offsets[1:] == offsets[:-1]] = -1.0
+        self.board_values = self.values.reshape(-1, len(self.tiles)).mean(axis=1)
+
+    # updates every expanded state once and returns the total change of their values
+    def sweep(self):
+        self.prepare()
+        states = self.expanded * len(self.tiles)
+        previous = self.values[:states].copy()
+        self.update(numpy.arange(states))
+        self.decisions = None
+        return float(numpy.abs(self.values[:states] - previous).sum())
+
+    # performs the value-iteration algorithm on the explored states
+    # every round computes the Bellman residual of all the states, then updates the states
+    # whose residual is above epsilon / states in blocks of decreasing residual, each block
+    # using the values of the blocks before it (Gauss-Seidel)
+    # the progress is printed at most every interval seconds, and every sweep is recorded in
+    # metrics when given (a Metrics.Metrics)
+    def converge(self, epsilon=1e-6, blocks=64, verbose=True, interval=1.0, metrics=None):
+        self.prepare()
+        states = self.expanded * len(self.tiles)
+
+        start = time.time()
+        last = start
+        updates = 0
+        sweep = 0
+        while True:
+            sweep_start = time.time()
+            residuals = numpy.abs(self.maxima(self.move_values()) - self.values[:states])
+            residual = residuals.sum()
+            if verbose and (time.time() - last >= interval or residual <= epsilon):
+                last = time.time()
+                elapsed = max(time.time() - start, 1e-9)
+                print("Sweep %d : residual %f, %.0f state updates/s" % (sweep, residual, updates / elapsed))
+            if residual <= epsilon:
+                break
+
+            order = numpy.argsort(-residuals)
+            order = order[residuals[order] > epsilon / states]
+            for block in numpy.array_split(order, min(blocks, len(order))):
+                self.update(block)
+            self.board_values = self.values.reshape(-1, len(self.tiles)).mean(axis=1)
+            updates += states + len(order)
+            if metrics is not None:
+                metrics.log('sweep', sweep=sweep, states=states, residual=float(residual), updated=len(order),
+                            time=time.time() - sweep_start)
+            sweep += 1
+
+        self.decisions = None
+
+    # returns the state id of the tile on the field, the field of the board and the tile on it
+    def state(self, field, tile):
+        key, tile, mirrored = self.canonical(field, tile)
+        if mirrored:
+            field = field.mirror()
+        return self.ids[key] * len(self.tiles) + tile, field, tile
+
+    # returns the expected score of the state
+    def expectation(self, field, tile):
+        return self.values[self.state(field, tile)[0]]
+
+    # returns the best move according to the value-iteration policy
+    def move(self, field, tile):
+        if self.decisions is None:
+            self.decide()
+
+        state, board, board_tile = self.state(field, tile)
+        return self.decision_move(field, tile, board, board_tile, self.decisions[state])
+
+    # returns the move of the decision taken for the tile on the board, -1 if there is none
+    # when the board is the mirror image of the field, the move is mapped back to the field
+    def decision_move(self, field, tile, board, board_tile, decision):
+        if decision == -1:
+            return None
+
+        move = board.positions(self.tiles[board_tile])[decision]
+        if board is field:
+            return move
+
+        # the board is the mirror image, find the move leading to the mirrored decision
+        target = board.successor(self.tiles[board_tile], move)[0].mirror_key()
+        for move in field.positions(self.tiles[tile]):
+            if field.successor(self.tiles[tile], move)[0].key() == target:
+                return move
+
+    def print(self):
+        if self.decisions is None:
+            self.decide()
+
+        for state in range(self.expanded * len(self.tiles)):
+            board, tile = divmod(state, len(self.tiles))
+            self.print_state(self.keys[board], tile, self.values[state], self.decisions[state])
+
+    # prints the tile on the board of the key, its expected score and the board after the decision
+    def print_state(self, key, tile, value, decision):
+        field = BitField.BitField.from_key(self.n, self.m, key)
+        self.tiles[tile].print()
+        print("Expected score : %f" % value)
+        field.print()
+        if decision != -1:
+            print("=>")
+            move = field.positions(self.tiles[tile])[decision]
+            field.successor(self.tiles[tile], move)[0].print()
+        else:
+            print("GAME OVER")
+        print()